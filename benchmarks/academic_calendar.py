@@ -0,0 +1,84 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from database import Database, AsyncDatabase
+from time_manager import TimeManager
+from timetable import Timetable
+
+# Задержка /daily (при готовом кэше расписания) со старым и новым расчетом курса и семестра
+REPEATS = 20
+
+
+class LegacyTimeManager(TimeManager):
+    # Прежняя реализация: перебор секунд семестра и strptime на каждый вызов
+    def graduate_range(self, date=None, timestamp=False):
+        if not date:
+            date = self.now
+        date_string = '01/09/{year} 00:00:00'.format(year=date.year)
+        start = datetime.strptime(date_string, "%d/%m/%Y %H:%M:%S")
+        end = start + timedelta(days=17*7 + 2*7 + 24*7)
+        if timestamp:
+            return (start.timestamp(), end.timestamp())
+        return (start, end)
+
+    def semesters_time_slices(self, date=None, timestamp=False):
+        start = self.graduate_range(date)[0]
+        slices = [(start, start + timedelta(days=17*7)), (start + timedelta(days=19*7), start + timedelta(days=43*7))]
+        return [(int(item[0].timestamp()), int(item[1].timestamp())) for item in slices]
+
+    def get_grade(self, date=None, start_year=None):
+        if not date:
+            date = self.now
+        grade_diff = self.graduate_range(date, timestamp=True)[0] - 1630443600
+        grade = int(round((grade_diff / 60 / 60 / 24 // 365) + 1, 0))
+        if start_year is not None:
+            grade += 2021 - start_year
+        return grade
+
+    def get_semester(self, date=None):
+        if not date:
+            date = self.now
+        for index, semester in enumerate(self.semesters_time_slices(date, timestamp=True)):
+            if int(date.timestamp()) in iter(range(*semester)):
+                return index
+        return None
+
+
+class FixedTime:
+    # Фиксированная дата в конце осеннего семестра - худший случай для перебора
+    now = datetime(2022, 12, 20, 10, 0, tzinfo=TimeManager().timezone)
+
+
+def make(cls):
+    return type(cls.__name__, (FixedTime, cls), {})()
+
+
+async def measure(tm: TimeManager, path: str):
+    timetable = Timetable(AsyncDatabase(Database(path)), tm)
+    await timetable.load()
+    await timetable.daily_text(config.graduate_group)
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        await timetable.daily_text(config.graduate_group)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite')
+        shutil.copy(os.path.join(config.project_root, config.db_path), path)
+        for name, cls in [('before', LegacyTimeManager), ('after', TimeManager)]:
+            latency = asyncio.run(measure(make(cls), path))
+            print(f'/daily {name:<7} {latency:10.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
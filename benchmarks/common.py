@@ -0,0 +1,74 @@
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from aiogram.utils.exceptions import RetryAfter, NetworkError
+
+# Общее для бенчмарков: схема базы, перцентили и поддельный Bot API
+
+
+# Таблицы бота копируются из db.sqlite проекта. Служебные таблицы (sqlite_sequence, sqlite_stat1)
+# и теневые таблицы полнотекстового индекса так создать нельзя, поэтому берем только нужные
+def copy_schema(conn: sqlite3.Connection, tables: tuple = ('lessons', 'notes', 'users')):
+    schema = sqlite3.connect(os.path.join(config.project_root, config.db_path))
+    queries = [row[0] for row in schema.execute(
+        f"SELECT sql FROM sqlite_master WHERE type = 'table' AND name IN ({', '.join('?' * len(tables))})", tables)]
+    schema.close()
+    for query in queries:
+        conn.execute(query)
+
+
+def percentile(values: list, percent: float):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class FakeBot:
+    # Отвечает на запросы Bot API минимальными корректными ответами с задержкой latency.
+    # retry_after и network_error - доли запросов, которые падают с RetryAfter(flood_wait) и NetworkError
+    def __init__(self, latency: float = 0, retry_after: float = 0, network_error: float = 0, flood_wait: int = 1):
+        self.latency = latency
+        self.retry_after = retry_after
+        self.network_error = network_error
+        self.flood_wait = flood_wait
+        self.calls = {}
+        self.errors = {}
+        # Сколько раз отправлялся каждый текст - по нему видно повторы
+        self.attempts = {}
+
+    def __fail(self):
+        roll = random.random()
+        if roll < self.retry_after:
+            return RetryAfter(self.flood_wait)
+        if roll < self.retry_after + self.network_error:
+            return NetworkError('Connection reset by peer')
+        return None
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        data = data or {}
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if 'text' in data:
+            self.attempts[data['text']] = self.attempts.get(data['text'], 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        error = self.__fail()
+        if error is not None:
+            self.errors[type(error).__name__] = self.errors.get(type(error).__name__, 0) + 1
+            raise error
+        if method in ('deleteMessage', 'answerCallbackQuery', 'setWebhook'):
+            return True
+        chat_id = int(data.get('chat_id', -1))
+        message = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'group'}}
+        if method == 'sendPoll':
+            # /vote запоминает опрос по его id
+            message['poll'] = {'id': str(self.calls[method]), 'question': data.get('question', ''), 'options': [],
+                               'total_voter_count': 0, 'is_closed': False, 'is_anonymous': False,
+                               'type': 'regular', 'allows_multiple_answers': False}
+        return message
@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from common import FakeBot, copy_schema, percentile
+from time_manager import TimeManager
+
+# Нагрузочный прогон обработчиков main.py: синтетические обновления идут прямо в Dispatcher,
+# а запросы к Telegram перехватываются и только записываются
+
+
+def seed_database(path: str, lessons: int, notes: int, chats: int):
+    # Пары текущего курса и семестра на все дни недели, чтобы /week, /daily и /vote было что показывать
+    grade, semester = TimeManager().academic_position()
+    conn = sqlite3.connect(path)
+    copy_schema(conn)
+    conn.executemany('INSERT INTO lessons (name, weekday, time, semester, grade, room_number, teacher, group_num) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     ((f'Предмет {index}', index % 7 + 1, '10:10', semester or 0, grade, 100 + index, 'Преподаватель',
+                       index % 3)
+                      for index in range(lessons)))
+    now = int(time.time())
+    conn.executemany('INSERT INTO notes (text, lesson_id, timeEnd, status, chat_id) VALUES (?, ?, ?, ?, ?)',
+                     ((f'Заметка {index}', random.randint(1, lessons), now + random.randint(-30, 30) * 86400,
+                       int(random.random() < 0.2), -random.randint(1, chats))
+                      for index in range(notes)))
+    conn.commit()
+    conn.close()
+
+
+class Updates:
+    def __init__(self, chats: int):
+        self.chats = chats
+        self.update_id = 0
+
+    def __next_id(self):
+        self.update_id += 1
+        return self.update_id
+
+    def chat(self, chat_id: int = None):
+        return {'id': chat_id or -random.randint(1, self.chats), 'type': 'group', 'title': 'bench'}
+
+    def message(self, text: str, chat: dict = None, user_id: int = 1):
+        entities = []
+        if text.startswith('/'):
+            entities.append({'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])})
+        return {'update_id': self.__next_id(), 'message': {
+            'message_id': self.update_id, 'date': int(time.time()), 'chat': chat or self.chat(),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'}, 'text': text, 'entities': entities}}
+
+    def callback(self, data: str, chat: dict = None, user_id: int = 1):
+        chat = chat or self.chat()
+        return {'update_id': self.__next_id(), 'callback_query': {
+            'id': str(self.update_id), 'chat_instance': '1', 'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat,
+                        'from': {'id': 2, 'is_bot': True, 'first_name': 'Bot'}, 'text': 'menu'}}}
+
+
+async def run_scenario(main, factory, iterations: int, concurrency: int):
+    from aiogram import types
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index: int):
+        async with semaphore:
+            steps = factory(index)
+            start = time.perf_counter()
+            for raw in steps:
+                # Как и при polling, каждое обновление обрабатывается в своей задаче со своим контекстом
+                await asyncio.create_task(main.dp.process_update(types.Update(**raw)))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(index) for index in range(iterations)])
+    elapsed = time.perf_counter() - start
+    return {
+        'count': iterations,
+        'throughput': iterations / elapsed,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+async def benchmark(args):
+    import main
+    from aiogram import Bot, Dispatcher
+    import callbacks
+
+    fake = FakeBot(args.latency)
+    main.app.request = fake.request
+    Bot.set_current(main.app)
+    Dispatcher.set_current(main.dp)
+    # Без архивации, рассылки и напоминаний в фоне, чтобы они не мешали замерам, и без сервера метрик
+    await main.start_subsystems(reminders=False, metrics=False)
+
+    updates = Updates(args.chats)
+    note_ids = [row.id for row in await main.db.query_all('SELECT id FROM notes WHERE status = 0 LIMIT 1000')]
+
+    def add_note_flow(index: int):
+        chat = updates.chat(-(args.chats + index + 1))
+        return [
+            updates.message('/add_note', chat),
+            updates.message('Текст заметки', chat),
+            updates.callback(callbacks.lesson_note.new(id=1), chat),
+            updates.message('1/12/2099 10:30', chat),
+        ]
+
+    scenarios = {
+        '/help': lambda index: [updates.message('/help')],
+        '/random': lambda index: [updates.message('/random 1 100')],
+        '/notes': lambda index: [updates.message('/notes')],
+        '/week': lambda index: [updates.message('/week')],
+        '/daily': lambda index: [updates.message('/daily')],
+        '/vote': lambda index: [updates.message('/vote')],
+        'view_notes': lambda index: [updates.callback(callbacks.view_notes.new(
+            page=1, direction='n', time=int(time.time()) + random.randint(0, 30) * 86400, id=0))],
+        'view_note': lambda index: [updates.callback(callbacks.view_note.new(id=random.choice(note_ids)))],
+        'delete_note': lambda index: [updates.callback(callbacks.delete_note.new(id=random.choice(note_ids)))],
+        'add_note flow': add_note_flow,
+    }
+    selected = args.handlers or list(scenarios)
+
+    results = {}
+    for name in selected:
+        results[name] = await run_scenario(main, scenarios[name], args.iterations, args.concurrency)
+        result = results[name]
+        print(f'{name:<14} {result["throughput"]:9.1f} upd/s   p50 {result["p50_ms"]:7.2f} ms   '
+              f'p95 {result["p95_ms"]:7.2f} ms   p99 {result["p99_ms"]:7.2f} ms')
+
+    await main.metrics_server.stop()
+    await main.digest.stop()
+    await main.maintenance.stop()
+    await main.ck.stop()
+    await main.sender.close()
+    await main.dp.storage.close()
+    await main.dp.storage.wait_closed()
+    await main.db.close()
+    return results, fake.calls
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=config.project_root,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон обработчиков бота')
+    parser.add_argument('--lessons', type=int, default=200)
+    parser.add_argument('--notes', type=int, default=100_000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0, help='задержка ответа Bot API, секунды')
+    parser.add_argument('--handlers', nargs='*', help='какие обработчики гонять (по умолчанию все)')
+    parser.add_argument('--output', default='bench_handlers.json', help='куда сохранить результаты в JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite')
+        seed_database(path, args.lessons, args.notes, args.chats)
+        config.db_path = path
+        results, calls = asyncio.run(benchmark(args))
+
+    report = {
+        'commit': git_commit(),
+        'date': int(time.time()),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'handlers': results,
+        'api_calls': calls,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f'Results saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
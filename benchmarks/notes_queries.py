@@ -0,0 +1,66 @@
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import copy_schema
+from database import Database
+
+# Замер get_active_notes на таблицах заметок разного размера
+SIZES = [10_000, 100_000, 1_000_000]
+CHATS = 500
+REPEATS = 5
+
+
+def create_database(path: str, size: int):
+    conn = sqlite3.connect(path)
+    copy_schema(conn)
+    now = int(time.time())
+    rows = (
+        (f'Заметка {index}', random.randint(1, 20), now + random.randint(-365, 30) * 86400,
+         int(random.random() < 0.3), -random.randint(1, CHATS))
+        for index in range(size)
+    )
+    conn.executemany('INSERT INTO notes (text, lesson_id, timeEnd, status, chat_id) VALUES (?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def legacy_active_notes(db: Database, **kwargs):
+    current_time = db.tm.timestamp
+    notes = db.get_all_notes(**kwargs)
+    return list(filter(lambda note: note.timeEnd > current_time and not(note.status), notes))
+
+
+def measure(func, *args, **kwargs):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        func(*args, **kwargs)
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+
+def main():
+    print(f'{"notes":>10} {"query":<28} {"legacy, ms":>12} {"sql, ms":>10}')
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite')
+            create_database(path, size)
+            db = Database(path)
+            chat_id = -random.randint(1, CHATS)
+            cases = [
+                ('active notes of one chat', {'chat_id': chat_id}),
+                ('active notes of all chats', {}),
+            ]
+            for name, kwargs in cases:
+                legacy = measure(legacy_active_notes, db, **kwargs)
+                current = measure(db.get_active_notes, **kwargs)
+                print(f'{size:>10} {name:<28} {legacy:>12.2f} {current:>10.2f}')
+            db.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Note, get_row_class
+
+# Сравнение строк Note с прежними dict_factory + DatabaseObject по памяти и скорости
+ROWS = 100_000
+
+
+def dict_factory(cursor, row):
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+class DatabaseObject(object):
+    def __init__(self, data: dict = None, **kwargs):
+        self.data = data
+        if kwargs:
+            self.data.update(**kwargs)
+        self.none_output = None
+
+    def __getattr__(self, item):
+        try:
+            return self.data[str(item)]
+        except:
+            return self.none_output
+
+
+def create_connection():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, text TEXT, lesson_id INTEGER, addition TEXT, '
+                 'timeEnd INTEGER, status INTEGER, chat_id INTEGER)')
+    conn.executemany('INSERT INTO notes (text, lesson_id, timeEnd, status, chat_id) VALUES (?, ?, ?, ?, ?)',
+                     ((f'Заметка {index}', index % 20, 1700000000 + index, index % 2, -index % 300) for index in range(ROWS)))
+    return conn
+
+
+def load_legacy(conn):
+    conn.row_factory = dict_factory
+    rows = [DatabaseObject(row) for row in conn.execute('SELECT * FROM notes').fetchall()]
+    conn.row_factory = None
+    return rows
+
+
+def load_rows(conn):
+    cursor = conn.execute('SELECT * FROM notes')
+    rows = cursor.fetchall()
+    make = get_row_class('notes', cursor.description)._make
+    return [make(row) for row in rows]
+
+
+def measure_memory(func, conn):
+    tracemalloc.start()
+    rows = func(conn)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return rows, size
+
+
+def main():
+    conn = create_connection()
+    print(f'{ROWS} rows of notes')
+    for name, func in [('DatabaseObject', load_legacy), ('Note', load_rows)]:
+        load_time = timeit.timeit(lambda: func(conn), number=5) / 5 * 1000
+        rows, size = measure_memory(func, conn)
+        row = rows[ROWS // 2]
+        access = timeit.timeit(lambda: (row.id, row.timeEnd, row.chat_id, row.text), number=1_000_000)
+        print(f'{name:<16} load {load_time:8.1f} ms   memory {size / 2**20:7.1f} MiB   '
+              f'4 attributes x 1M {access * 1000:7.1f} ms')
+    assert type(load_rows(conn)[0]) is Note
+
+
+if __name__ == '__main__':
+    main()
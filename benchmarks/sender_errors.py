@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from common import FakeBot, percentile
+
+# Прогон Sender на настоящем Bot с поддельным Bot API, который отвечает с задержкой
+# и иногда падает с RetryAfter или NetworkError, чтобы проверить повторы и паузы между ними
+
+
+async def benchmark(args):
+    from aiogram import Bot
+    from sender import Sender
+
+    fake = FakeBot(args.latency, args.retry_after, args.network_error, args.flood_wait)
+    bot = Bot('123456:bench', validate_token=False)
+    bot.request = fake.request
+    sender = Sender(bot)
+    latencies, failed = [], []
+
+    async def one(index: int):
+        chat_id = random.randint(1, args.chats)
+        start = time.perf_counter()
+        try:
+            await sender.send_message(chat_id, f'message {index}')
+        except Exception as e:
+            failed.append(type(e).__name__)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(index) for index in range(args.messages)])
+    elapsed = time.perf_counter() - start
+    await sender.close()
+    await bot.close()
+
+    attempts = list(fake.attempts.values())
+    return {
+        'count': args.messages,
+        'elapsed_s': elapsed,
+        'throughput': args.messages / elapsed,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'calls': fake.calls,
+        'errors': fake.errors,
+        'max_attempts': max(attempts),
+        'retried': sum(1 for count in attempts if count > 1),
+        'failed': {name: failed.count(name) for name in set(failed)},
+        'chat_buckets': len(sender.chat_buckets),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Прогон очереди отправки с ошибками Bot API')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа Bot API, секунды')
+    parser.add_argument('--retry-after', type=float, default=0.02, help='доля ответов RetryAfter')
+    parser.add_argument('--network-error', type=float, default=0.05, help='доля ответов NetworkError')
+    parser.add_argument('--flood-wait', type=int, default=1, help='пауза в RetryAfter, секунды')
+    parser.add_argument('--output', default='bench_sender.json', help='куда сохранить результаты в JSON')
+    args = parser.parse_args()
+
+    # Личные чаты: лимит одно сообщение в секунду на чат, общий - config.sender_global_rate
+    result = asyncio.run(benchmark(args))
+    print(f'{result["count"]} messages in {result["elapsed_s"]:.1f} s   {result["throughput"]:7.1f} msg/s   '
+          f'p50 {result["p50_ms"]:8.1f} ms   p95 {result["p95_ms"]:8.1f} ms   p99 {result["p99_ms"]:8.1f} ms')
+    print(f'calls {result["calls"]}   errors {result["errors"]}   retried {result["retried"]}   '
+          f'max attempts {result["max_attempts"]}   failed {result["failed"]}')
+
+    report = {
+        'date': int(time.time()),
+        'params': {key: value for key, value in vars(args).items() if key != 'output'},
+        'config': {'workers': config.sender_workers, 'global_rate': config.sender_global_rate,
+                   'private_rate': config.sender_private_rate, 'retries': config.sender_retries},
+        'result': result,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f'Results saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import copy_schema
+from database import Database, AsyncDatabase
+
+# Замер записи заметок: коммит после каждой строки, insert_many и групповой коммит
+ROWS = 2000
+
+
+def create_database(path: str):
+    conn = sqlite3.connect(path)
+    copy_schema(conn)
+    conn.commit()
+    conn.close()
+
+
+def notes(count: int):
+    now = int(time.time())
+    return [{'text': f'Заметка {index}', 'lesson_id': 1, 'timeEnd': now + 86400, 'status': 0, 'chat_id': -1}
+            for index in range(count)]
+
+
+def legacy(path: str):
+    # Как было раньше: журнал отката и fsync на каждую запись
+    db = Database(path)
+    db.db.execute('PRAGMA journal_mode = DELETE')
+    db.db.execute('PRAGMA synchronous = FULL')
+    for note in notes(ROWS):
+        db.add_note(**note)
+    db.close()
+
+
+def wal(path: str):
+    db = Database(path)
+    for note in notes(ROWS):
+        db.add_note(**note)
+    db.close()
+
+
+def insert_many(path: str):
+    db = Database(path)
+    db.insert_many('notes', notes(ROWS))
+    db.close()
+
+
+def group_commit(path: str):
+    async def run():
+        db = AsyncDatabase(Database(path), commit_interval=0.005)
+        await asyncio.gather(*[db.add_note(**note) for note in notes(ROWS)])
+        await db.close()
+    asyncio.run(run())
+
+
+def main():
+    print(f'{ROWS} notes')
+    for func in (legacy, wal, insert_many, group_commit):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.sqlite')
+            create_database(path)
+            start = time.perf_counter()
+            func(path)
+            elapsed = time.perf_counter() - start
+        print(f'{func.__name__:<14} {elapsed * 1000:9.1f} ms   {ROWS / elapsed:10.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import json
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+
+
+class Callback:
+    # Данные кнопки в виде "action:значение:значение" вместо JSON, чтобы уложиться в 64 байта
+    sep = ':'
+
+    def __init__(self, action: str, **fields: type):
+        self.action = action
+        self.fields = fields
+
+    def new(self, **values) -> str:
+        # Поля разбираются по позиции, поэтому опускать можно только последние
+        fields = list(self.fields)[:sum(name in values for name in self.fields)]
+        missing = [name for name in fields if name not in values]
+        if missing:
+            raise ValueError(f'Callback {self.action} is missing {", ".join(missing)}')
+        parts = [self.action] + [str(values[name]) for name in fields]
+        data = self.sep.join(parts)
+        if len(data.encode()) > 64:
+            raise ValueError(f'Callback data is too long: {data}')
+        return data
+
+    def parse(self, parts: list) -> dict:
+        return {name: field_type(value) for (name, field_type), value in zip(self.fields.items(), parts)}
+
+
+lesson_note = Callback('lesson_note', id=int)
+cancel_note = Callback('cancel_note')
+# direction 'n' - страница после заметки (time, id), 'p' - перед ней
+view_notes = Callback('view_notes', page=int, direction=str, time=int, id=int)
+view_note = Callback('view_note', id=int)
+delete_note = Callback('delete_note', id=int)
+
+
+def check_state(expected, current: str):
+    if expected == '*':
+        return True
+    if expected is None:
+        return current is None
+    if isinstance(expected, State):
+        return current == expected.state
+    if isinstance(expected, type) and issubclass(expected, StatesGroup):
+        return current in expected.all_states_names
+    return current == expected
+
+
+class CallbackRouter:
+    # Один обработчик на все нажатия: данные разбираются один раз и передаются нужной функции по action
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, callback: Callback, state=None):
+        def decorator(handler):
+            self.routes[callback.action] = (callback, handler, state)
+            return handler
+        return decorator
+
+    def decode(self, data: str):
+        # Кнопки старых сообщений еще содержат JSON
+        if data.startswith('{'):
+            data = json.loads(data)
+            action = data.pop('action', None)
+            route = self.routes.get(action)
+            return route, data
+        action, *parts = data.split(Callback.sep)
+        route = self.routes.get(action)
+        if not route:
+            return None, {}
+        return route, route[0].parse(parts)
+
+    async def dispatch(self, query: types.CallbackQuery, state: FSMContext):
+        try:
+            route, data = self.decode(query.data or '')
+        except (ValueError, TypeError):
+            route, data = None, {}
+        if not route:
+            return await query.answer()
+        _, handler, expected_state = route
+        if not check_state(expected_state, await state.get_state()):
+            return await query.answer()
+        return await handler(query, data, state)
+
+    def setup(self, dp: Dispatcher, *filters):
+        dp.register_callback_query_handler(self.dispatch, *filters, state='*')
@@ -0,0 +1,52 @@
+import asyncio
+
+import config
+from database import AsyncDatabase, ChatSettings
+
+
+class ChatSettingsCache:
+    # Настройки чатов в памяти: chat_id -> ChatSettings. Чаты без настроек получают группу по умолчанию
+    def __init__(self, db: AsyncDatabase):
+        self.loop = None
+        self.db = db
+        self.chats = {}
+        self.hits = 0
+        self.misses = 0
+        db.sync.subscribe('chat_settings', self.__on_changed)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.chats),
+                'hit_ratio': self.hits / total if total else 0.0}
+
+    def default(self, chat_id: int):
+        return ChatSettings(chat_id=chat_id, group_num=config.graduate_group, start_year=None, digest=0, digest_time=None)
+
+    async def preload(self):
+        self.loop = asyncio.get_running_loop()
+        rows = await self.db.select_all('chat_settings')
+        self.chats = {row.chat_id: row for row in rows}
+
+    async def get(self, chat_id: int):
+        settings = self.chats.get(chat_id)
+        if settings is not None:
+            self.hits += 1
+            return settings
+        self.misses += 1
+        settings = await self.db.get_chat_settings(chat_id) or self.default(chat_id)
+        self.chats[chat_id] = settings
+        return settings
+
+    async def set(self, chat_id: int, **kwargs):
+        # Чат без настроек получает группу по умолчанию, а не 0 из схемы таблицы
+        await self.db.set_chat_settings(chat_id, defaults={'group_num': self.default(chat_id).group_num}, **kwargs)
+
+    # Уведомления приходят из потока базы данных
+    def __on_changed(self, action: str, data: dict, statements: dict):
+        if self.loop is None:
+            return
+        chat_id = (statements or {}).get('chat_id')
+        if chat_id is None:
+            self.loop.call_soon_threadsafe(self.chats.clear)
+        else:
+            self.loop.call_soon_threadsafe(self.chats.pop, chat_id, None)
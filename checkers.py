@@ -1,35 +1,177 @@
 import asyncio
+import heapq
+import time
 
 from aiogram import types, Bot
 
 import config
-from database import Database
+import metrics
+from database import AsyncDatabase
+from sender import Sender
 
 class Checkers:
-    def __init__(self, app: Bot, db: Database):
-        self.loop = asyncio.get_event_loop()
+    # Для напоминаний хватает этих колонок заметки
+    note_columns = ('id', 'text', 'timeEnd', 'chat_id')
+
+    def __init__(self, app: Bot, db: AsyncDatabase, sender: Sender):
+        self.loop = None
         self.app = app
         self.db = db
-        self.note_check_obj = asyncio.run_coroutine_threadsafe(self.notes_checker(), self.loop)
+        self.sender = sender
+        # chat_id -> {note_id: note}
+        self.__notes = {}
+        # Очередь событий: (время, тип, ключ). Тип 'remind' - напомнить чату, 'expire' - заметка истекла
+        self.__heap = []
+        self.__reminders = {}
+        self.__wakeup = asyncio.Event()
+        self.note_check_obj = None
+        self.watch_interval = None
+        self.__fingerprint = None
+        db.sync.subscribe('notes', self.__on_notes_changed)
+
+    # watch_interval - как часто проверять заметки, измененные другими процессами
+    async def start(self, watch_interval: float = None):
+        self.loop = asyncio.get_running_loop()
+        self.watch_interval = watch_interval
+        await self.load_notes()
+        self.note_check_obj = self.loop.create_task(self.notes_checker())
+
+    async def stop(self):
+        if self.note_check_obj is not None:
+            self.note_check_obj.cancel()
+            self.note_check_obj = None
+
+    def __push(self, when: float, kind: str, key):
+        item = (when, kind, key)
+        heapq.heappush(self.__heap, item)
+        # Новое событие раньше всех остальных - будим цикл, чтобы пересчитать таймаут
+        if self.__heap[0] == item:
+            self.__wakeup.set()
+
+    def __add_note(self, note, remind_at: float = None):
+        notes = self.__notes.setdefault(note.chat_id, {})
+        notes[note.id] = note
+        self.__push(note.timeEnd, 'expire', (note.chat_id, note.id))
+        if note.chat_id not in self.__reminders:
+            if remind_at is None:
+                remind_at = time.time() + config.note_checker_cooldown
+            self.__reminders[note.chat_id] = remind_at
+            self.__push(remind_at, 'remind', note.chat_id)
+
+    def __remove_note(self, chat_id: int, note_id: int):
+        notes = self.__notes.get(chat_id, {})
+        notes.pop(note_id, None)
+        if not notes:
+            self.__notes.pop(chat_id, None)
+            # Устаревшая запись в куче будет пропущена при извлечении
+            self.__reminders.pop(chat_id, None)
+
+    # reminders - время напоминаний при перечитывании. При запуске (reminders=None) чатам напоминаем сразу,
+    # а при перечитывании новые чаты ждут обычный cooldown, как заметки, добавленные в этом процессе
+    async def load_notes(self, reminders: dict = None):
+        self.__fingerprint = await self.db.notes_fingerprint()
+        notes = await self.db.get_active_notes_with_lessons(self.note_columns)
+        now = time.time()
+        default = now if reminders is None else now + config.note_checker_cooldown
+        reminders = reminders or {}
+        self.__notes = {}
+        self.__heap = []
+        self.__reminders = {}
+        for note in notes:
+            self.__add_note(note, reminders.get(note.chat_id, default))
+        self.__wakeup.set()
+
+    # Изменения других процессов: новые заметки берутся по id больше последнего виденного,
+    # а удаленные и выполненные ищутся только среди заметок в памяти и только если число заметок не сошлось
+    async def __sync(self, fingerprint: tuple):
+        old_count, old_max = self.__fingerprint
+        count, _ = self.__fingerprint = fingerprint
+        notes = await self.db.get_active_notes_with_lessons(self.note_columns, after_id=old_max or 0)
+        for note in notes:
+            if note.id not in self.__notes.get(note.chat_id, {}):
+                self.__add_note(note)
+        if count - old_count == len(notes):
+            return
+        known = [note_id for notes in self.__notes.values() for note_id in notes]
+        active = set(await self.db.get_active_note_ids(known))
+        for chat_id, notes in list(self.__notes.items()):
+            for note_id in [note_id for note_id in notes if note_id not in active]:
+                self.__remove_note(chat_id, note_id)
+
+    # Вызывается из потока базы данных
+    def __on_notes_changed(self, action: str, data: dict, statements: dict):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.__refresh(action, data, statements)))
+
+    async def __refresh(self, action: str, data: dict, statements: dict):
+        try:
+            note_id = (data or {}).get('id') if action == 'insert' else (statements or {}).get('id')
+            if note_id is None:
+                # Массовое изменение - перечитываем заметки, сохраняя время напоминаний
+                return await self.load_notes(dict(self.__reminders))
+
+            for chat_id, notes in list(self.__notes.items()):
+                if note_id in notes:
+                    self.__remove_note(chat_id, note_id)
+            notes = await self.db.get_active_notes_with_lessons(self.note_columns, id=note_id)
+            for note in notes:
+                self.__add_note(note)
+        except Exception as e:
+            print('[!] NOTES CHECKER ERROR:', str(e))
+
+    def reminder_text(self, chat_id: int):
+        notes = sorted(self.__notes.get(chat_id, {}).values(), key=lambda note: (note.timeEnd, note.id))
+        text = '💬 <b>Не забывайте про Ваши заметки:</b>\n\n'
+        notes_str = [f'{index+1}. <b>{note.lesson_name or "??"}</b> - <code>{note.text}</code>' for index, note in enumerate(notes)]
+        text += '\n'.join(notes_str)
+        return text
+
+    # Возвращает chat_id, если чату пора отправить напоминание
+    def __process(self, kind: str, key, when: float):
+        if kind == 'expire':
+            chat_id, note_id = key
+            note = self.__notes.get(chat_id, {}).get(note_id)
+            if note and note.timeEnd == when:
+                self.__remove_note(chat_id, note_id)
+            return None
+
+        chat_id = key
+        if self.__reminders.get(chat_id) != when:
+            return None
+        self.__reminders[chat_id] = time.time() + config.note_checker_cooldown
+        self.__push(self.__reminders[chat_id], 'remind', chat_id)
+        return chat_id
 
     async def notes_checker(self):
         try:
             while True:
-                notes = self.db.get_active_notes()
-                chat_ids = list(set([note.chat_id for note in notes]))
-                if not all(chat_ids):
-                    await asyncio.sleep(config.note_checker_cooldown)
-                    continue
-                for chat_id in chat_ids:
-                    try:
-                        text = '💬 <b>Не забывайте про Ваши заметки:</b>\n\n'
-                        note_elem = list(filter(lambda note: note.chat_id == chat_id, notes))
-                        notes_str = [f'{index+1}. <b>{self.db.get_lesson(id=note.lesson_id).name}</b> - <code>{note.text}</code>' for index, note in enumerate(note_elem)]
-                        text += '\n'.join(notes_str)
-                        await self.app.send_message(chat_id, text)
-                    except Exception as e:
-                        print(e)
-
-                await asyncio.sleep(config.note_checker_cooldown)
+                self.__wakeup.clear()
+                start = time.perf_counter()
+                chat_ids = []
+                while self.__heap and self.__heap[0][0] <= time.time():
+                    when, kind, key = heapq.heappop(self.__heap)
+                    chat_id = self.__process(kind, key, when)
+                    if chat_id:
+                        chat_ids.append(chat_id)
+
+                # Истекшие заметки уже убраны, отправляем напоминания параллельно через очередь
+                messages = [(chat_id, self.reminder_text(chat_id)) for chat_id in chat_ids if chat_id in self.__notes]
+                if messages:
+                    self.loop.create_task(self.sender.broadcast(messages))
+                    metrics.reminder_sweep.observe(time.perf_counter() - start)
+
+                timeout = self.__heap[0][0] - time.time() if self.__heap else None
+                if self.watch_interval:
+                    timeout = min(timeout, self.watch_interval) if timeout is not None else self.watch_interval
+                try:
+                    await asyncio.wait_for(self.__wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+                if self.watch_interval:
+                    fingerprint = await self.db.notes_fingerprint()
+                    if fingerprint != self.__fingerprint:
+                        await self.__sync(fingerprint)
         except Exception as e:
             print('[!] NOTES CHECKER ERROR:', str(e))
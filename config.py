@@ -6,10 +6,77 @@ botToken = '5982648910:AAH4QQ5Jj_bGpFndVtEp6dwCJpzLfxpDtPE'
 # путь к базе данных бота
 db_path = 'db.sqlite'
 
+# группа для чатов, которые не выбрали свою командой /setgroup
 graduate_group = 2
 
 chat_id = -1001710444985
 
 note_checker_cooldown = 1*60*60
 
+# отправка сообщений: число параллельных отправок и лимиты (сообщений в секунду)
+sender_workers = 8
+sender_global_rate = 30
+sender_group_rate = 20/60
+sender_private_rate = 1
+sender_retries = 5
+# как часто (в секундах) выбрасывать лимиты чатов, которые давно ничего не получали
+sender_sweep_interval = 60
+
+# как часто (в секундах) состояния FSM сбрасываются на диск
+fsm_flush_interval = 0.5
+# сколько состояний FSM держать в памяти
+fsm_cache_size = 10000
+
+# кэш зарегистрированных пользователей: размер и время жизни записей (в секундах)
+users_cache_size = 100000
+users_cache_ttl = 10*60
+
+# режим получения обновлений: 'polling' или 'webhook'
+mode = 'polling'
+
+# вебхук: внешний адрес (пустой - вебхук не регистрируется в Telegram), путь и адрес локального сервера
+webhook_url = ''
+webhook_path = '/bot'
+webapp_host = '127.0.0.1'
+webapp_port = 8080
+# сколько обновлений обрабатывать одновременно, сколько последних update_id помнить
+# и сколько секунд ждать незавершенные обновления при остановке
+webhook_concurrency = 64
+webhook_dedup_size = 10000
+webhook_drain_timeout = 10
+
+# запуск в несколько процессов (python workers.py): число процессов-обработчиков
+# и время (в секундах), на которое один из них захватывает рассылку напоминаний
+workers = 4
+leader_lock_ttl = 30
+# как часто (в секундах) рассылающий процесс проверяет заметки, добавленные другими процессами
+leader_watch_interval = 5
+
+# метрики в формате Prometheus на http://metrics_host:metrics_port/metrics
+metrics_enabled = True
+metrics_host = '127.0.0.1'
+metrics_port = 9100
+# семплирующий профайлер основного потока, отчет на /profile
+profiler_enabled = False
+profiler_interval = 0.01
+
+# архив заметок: удаленные и истекшие больше archive_after секунд назад заметки раз в archive_interval секунд
+# переносятся в таблицу notes_archive пачками по archive_batch_size
+archive_after = 24*60*60
+archive_interval = 60*60
+archive_batch_size = 500
+# час (по Москве), в который база сжимается и обновляется статистика для планировщика запросов
+maintenance_hour = 4
+
+# как часто (в секундах) проверять, не загрузили ли расписание из другого процесса (lessons_io.py)
+timetable_check_interval = 30
+
+# утренняя рассылка расписания: время по Москве для чатов, не выбравших свое, и как часто (в секундах) проверять,
+# кому пора отправить
+digest_time = '07:00'
+digest_check_interval = 60
+
+# групповой коммит: записи в базу сбрасываются на диск раз в db_commit_interval секунд (0 - коммит после каждой записи)
+db_commit_interval = 0
+
 project_root = os.path.dirname(__file__)
\ No newline at end of file
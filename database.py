@@ -1,7 +1,14 @@
+import json
 import os
+import re
 import sqlite3
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
 from typing import Optional, Union
 import functools
+from contextlib import contextmanager
 
 import config
 from time_manager import TimeManager
@@ -29,160 +36,424 @@ def handle_with(handler, *exceptions):
     return decorator
 
 
-# Особый порядок чтения для БД
-def dict_factory(cursor, row):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
-
-class DatabaseObject(object):
-    def __init__(self, data: dict = None, **kwargs: Union[int, str, list, float, tuple, dict]):
-        self.data = data
-        if kwargs:
-            self.data.update(**kwargs)
-        self.none_output = None
+class RowMixin:
+    __slots__ = ()
 
+    # Как и раньше, отсутствующие колонки читаются как None
     def __getattr__(self, item):
-        try:
-            return self.data[str(item)]
-        except:
-            return self.none_output
+        if item.startswith('__'):
+            raise AttributeError(item)
+        return None
 
     def __repr__(self):
-        return str(self.data)
+        return str(self._asdict())
 
     def get_raw(self):
-        return self.data
+        return self._asdict()
 
     def key(self, key: str):
-        try:
-            return self.data[str(key)]
-        except:
-            return self.none_output
+        return getattr(self, str(key), None)
 
-class Database:
-    def __init__(self, path: Union[os.PathLike, str] = 'db.sqlite'):
-        path = os.path.join(config.project_root, 'db.sqlite')
-        self.__db = sqlite3.connect(path)
-        self.__db.row_factory = dict_factory
-        self.__cursor = self.__db.cursor()
-        self.tm = TimeManager()
 
+def row_class(name: str, fields: Union[tuple, list]):
+    return type(name, (RowMixin, namedtuple(name, fields, rename=True)), {'__slots__': ()})
 
-    def __convert_list_to_object(self, list_data: list, **kwargs):
-        return [DatabaseObject(data, **kwargs) for data in list_data]
 
-    def __convert_dict_to_object(self, dict_data: dict, **kwargs):
-        return DatabaseObject(dict_data, **kwargs)
+Lesson = row_class('Lesson', ('id', 'name', 'weekday', 'time', 'semester', 'grade', 'room_number', 'teacher', 'group_num'))
+Note = row_class('Note', ('id', 'text', 'lesson_id', 'addition', 'timeEnd', 'status', 'chat_id'))
+User = row_class('User', ('id', 'user_id', 'full_name', 'regDate'))
+ChatSettings = row_class('ChatSettings', ('chat_id', 'group_num', 'start_year', 'digest', 'digest_time'))
 
-    @property
-    def db(self):
-        return self.__db
+row_classes = {
+    ('lessons', Lesson._fields): Lesson,
+    ('notes', Note._fields): Note,
+    ('users', User._fields): User,
+    ('chat_settings', ChatSettings._fields): ChatSettings,
+}
+table_names = {'lessons': 'Lesson', 'notes': 'Note', 'users': 'User', 'chat_settings': 'ChatSettings'}
 
-    @property
-    def cursor(self):
-        return self.__cursor
 
-    def __select_convert_args(self, dict_data: dict, **kwargs):
-        args_str = []
-        args = []
-        if kwargs:
-            dict_data.update(**kwargs)
+# Класс строки выбирается один раз на запрос по набору колонок
+def get_row_class(table: str, description: tuple):
+    fields = tuple(column[0] for column in description)
+    cls = row_classes.get((table, fields))
+    if cls is None:
+        cls = row_classes[(table, fields)] = row_class(table_names.get(table, 'Row'), fields)
+    return cls
 
-        for key, val in dict_data.items():
-            args.append(val)
-            args_str.append(f'{key} = ?')
 
-        return args_str, args
+# Схема таблиц, с которыми работают select/update/insert/delete: имена таблиц и колонок
+# проверяются по ней, потому что подставляются в текст запроса
+schema = {table: cls._fields for (table, _), cls in row_classes.items()}
 
-    def __insert_convert_args(self, dict_data: dict, **kwargs):
-        args_str = []
-        args = []
-        if kwargs:
-            dict_data.update(**kwargs)
 
-        for key, val in dict_data.items():
-            args.append(val)
-            args_str.append(f'{key}')
+def check_columns(table: str, columns: tuple):
+    fields = schema.get(table)
+    if fields is None:
+        raise ValueError(f'Unknown table: {table}')
+    unknown = [column for column in columns if column not in fields]
+    if unknown:
+        raise ValueError(f'Unknown columns in {table}: {", ".join(unknown)}')
 
-        return args_str, args
 
-    def select(self, table: str, statements: dict = None, output_keys: list = None):
-        args = []
-        if not output_keys:
-            query = f'SELECT * FROM {table}'
-        else:
-            query = f'SELECT ({", ".join(output_keys)}) FROM {table}'
+def conditions(table: str, columns: tuple, prefix: str = ''):
+    check_columns(table, columns)
+    return [f'{prefix}{column} = ?' for column in columns]
 
-        if statements:
-            args_str, args = self.__select_convert_args(statements)
-            query += f' WHERE {" AND ".join(args_str)}'
 
-        self.__cursor.execute(query, args)
-        return self.__convert_dict_to_object(self.__cursor.fetchone())
+# Текст запроса строится один раз на форму (таблица, колонки), поэтому sqlite
+# находит его в своем кэше подготовленных запросов
+@functools.lru_cache(maxsize=512)
+def select_query(table: str, columns: tuple = (), where: tuple = ()):
+    check_columns(table, columns)
+    query = f'SELECT {", ".join(columns) or "*"} FROM {table}'
+    if where:
+        query += f' WHERE {" AND ".join(conditions(table, where))}'
+    return query
 
-    def select_all(self, table: str, statements: dict = None, output_keys: list = None):
-        args = []
-        if not output_keys:
-            query = f'SELECT * FROM {table}'
-        else:
-            query = f'SELECT ({", ".join(output_keys)}) FROM {table}'
 
-        if statements:
-            args_str, args = self.__select_convert_args(statements)
-            query += f' WHERE {" AND ".join(args_str)}'
+@functools.lru_cache(maxsize=512)
+def update_query(table: str, columns: tuple, where: tuple = ()):
+    query = f'UPDATE {table} SET {", ".join(conditions(table, columns))}'
+    if where:
+        query += f' WHERE {" AND ".join(conditions(table, where))}'
+    return query
+
 
-        self.__cursor.execute(query, args)
-        return self.__convert_list_to_object(self.__cursor.fetchall())
+@functools.lru_cache(maxsize=512)
+def insert_query(table: str, columns: tuple):
+    check_columns(table, columns)
+    return f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
 
-    def __merge_tuples(self, *args: Union[tuple, list]):
-        tup_new = ()
-        for arg in args:
-            tup_new += tuple(arg)
-        return tup_new
+
+@functools.lru_cache(maxsize=512)
+def delete_query(table: str, where: tuple):
+    return f'DELETE FROM {table} WHERE {" AND ".join(conditions(table, where))}'
+
+class Database:
+    def __init__(self, path: Union[os.PathLike, str] = 'db.sqlite'):
+        self.path = os.path.join(config.project_root, path)
+        self.__db = None
+        self.__cursor = None
+        self.tm = TimeManager()
+        self.__listeners = {}
+        self.__query_hooks = []
+        self.__depth = 0
+        self.__deferred = []
+        # group_commit: записи вне transaction() не коммитятся сразу, их сбрасывает flush()
+        self.group_commit = False
+        self.dirty = False
+
+    # Файл базы открывается при первом запросе, а не при импорте
+    def connect(self):
+        if self.__db is None:
+            # Соединение используется только из потока AsyncDatabase
+            self.__db = sqlite3.connect(self.path, check_same_thread=False)
+            self.__db.execute('PRAGMA journal_mode = WAL')
+            self.__db.execute('PRAGMA synchronous = NORMAL')
+            self.__cursor = self.__db.cursor()
+            self.migrate()
+        return self.__db
+
+    def close(self):
+        if self.__db is not None:
+            self.flush()
+            self.__db.close()
+            self.__db = None
+            self.__cursor = None
+
+    # Миграции схемы: номер миграции хранится в PRAGMA user_version
+    migrations = [
+        [
+            'CREATE INDEX IF NOT EXISTS notes_chat_status_time ON notes (chat_id, status, timeEnd)',
+            'CREATE INDEX IF NOT EXISTS notes_status_time ON notes (status, timeEnd)',
+        ],
+        [
+            'CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT, expires REAL)',
+        ],
+        [
+            'CREATE TABLE IF NOT EXISTS notes_archive (id INTEGER PRIMARY KEY, text TEXT, lesson_id INTEGER, '
+            'addition TEXT, timeEnd INTEGER, status INTEGER, chat_id INTEGER, archived INTEGER)',
+        ],
+        [
+            'CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)',
+        ],
+        [
+            # start_year - год поступления группы, по нему считается курс; NULL - как у группы по умолчанию
+            'CREATE TABLE IF NOT EXISTS chat_settings (chat_id INTEGER PRIMARY KEY, group_num INTEGER NOT NULL DEFAULT 0, '
+            'start_year INTEGER)',
+            'CREATE INDEX IF NOT EXISTS lessons_grade_semester_weekday_group ON lessons (grade, semester, weekday, group_num)',
+        ],
+        [
+            # digest - подписка на утреннюю рассылку, digest_time - время "ЧЧ:ММ" (NULL - config.digest_time)
+            'ALTER TABLE chat_settings ADD COLUMN digest INTEGER NOT NULL DEFAULT 0',
+            'ALTER TABLE chat_settings ADD COLUMN digest_time TEXT',
+            # День последней рассылки по каждому чату
+            'CREATE TABLE IF NOT EXISTS digests (chat_id INTEGER PRIMARY KEY, day TEXT NOT NULL)',
+        ],
+        [
+            # Опросы /vote: lessons - id пар через запятую в порядке вариантов ответа,
+            # за ними идут варианты "на все пары" и "не идем"
+            'CREATE TABLE IF NOT EXISTS polls (poll_id TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, '
+            'lessons TEXT NOT NULL, created INTEGER NOT NULL)',
+            'CREATE INDEX IF NOT EXISTS polls_chat ON polls (chat_id)',
+            # Последний ответ каждого пользователя: номера вариантов через запятую
+            'CREATE TABLE IF NOT EXISTS poll_answers (poll_id TEXT NOT NULL, user_id INTEGER NOT NULL, '
+            'options TEXT NOT NULL, PRIMARY KEY (poll_id, user_id)) WITHOUT ROWID',
+            # Счетчики голосов по парам чата, lesson_id = 0 - голоса "не идем"
+            'CREATE TABLE IF NOT EXISTS attendance (chat_id INTEGER NOT NULL, lesson_id INTEGER NOT NULL, '
+            'votes INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (chat_id, lesson_id)) WITHOUT ROWID',
+        ],
+        [
+            # Полнотекстовый индекс по тексту заметок, синхронизируется триггерами
+            "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(text, content='notes', content_rowid='id')",
+            'CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN '
+            'INSERT INTO notes_fts (rowid, text) VALUES (new.id, new.text); END',
+            'CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN '
+            "INSERT INTO notes_fts (notes_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+            'CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF text ON notes BEGIN '
+            "INSERT INTO notes_fts (notes_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+            'INSERT INTO notes_fts (rowid, text) VALUES (new.id, new.text); END',
+            "INSERT INTO notes_fts (notes_fts) VALUES ('rebuild')",
+        ],
+    ]
+
+    def migrate(self):
+        version = self.cursor.execute('PRAGMA user_version').fetchone()[0]
+        for index, migration in enumerate(self.migrations[version:], start=version + 1):
+            for query in migration:
+                self.cursor.execute(query)
+            self.cursor.execute(f'PRAGMA user_version = {index}')
+            self.db.commit()
+        return len(self.migrations) - version
+
+
+    # Все запросы проходят здесь, чтобы их можно было замерить: hook(query, seconds)
+    def add_query_hook(self, hook):
+        self.__query_hooks.append(hook)
+
+    def execute(self, query: str, args: Union[tuple, list] = ()):
+        if not self.__query_hooks:
+            return self.cursor.execute(query, args)
+        start = time.perf_counter()
+        try:
+            return self.cursor.execute(query, args)
+        finally:
+            duration = time.perf_counter() - start
+            for hook in self.__query_hooks:
+                hook(query, duration)
+
+    def __fetchone(self, table: str = None):
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return get_row_class(table, self.cursor.description)._make(row)
+
+    def __fetchall(self, table: str = None):
+        rows = self.cursor.fetchall()
+        if not rows:
+            return []
+        make = get_row_class(table, self.cursor.description)._make
+        return [make(row) for row in rows]
+
+    @property
+    def db(self):
+        return self.connect()
+
+    @property
+    def cursor(self):
+        self.connect()
+        return self.__cursor
+
+    # Подписка на изменения таблицы: callback(action, data, statements)
+    def subscribe(self, table: str, callback):
+        self.__listeners.setdefault(table, []).append(callback)
+
+    def __notify(self, table: str, action: str, data: dict, statements: dict = None):
+        # Внутри транзакции подписчики узнают об изменениях только после коммита
+        if self.__depth:
+            self.__deferred.append((table, action, data, statements))
+            return
+        for callback in self.__listeners.get(table, []):
+            callback(action, data, statements)
+
+    def __commit(self):
+        if self.__depth:
+            return
+        if self.group_commit:
+            self.dirty = True
+            return
+        self.db.commit()
+
+    def flush(self):
+        if self.dirty:
+            self.dirty = False
+            self.db.commit()
+
+    # Несколько записей одним коммитом; при исключении все откатывается
+    @contextmanager
+    def transaction(self):
+        if not self.__depth:
+            self.flush()
+        self.__depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.__depth -= 1
+            if not self.__depth:
+                self.db.rollback()
+                self.__deferred.clear()
+            raise
+        self.__depth -= 1
+        if not self.__depth:
+            self.db.commit()
+            deferred, self.__deferred = self.__deferred, []
+            for notification in deferred:
+                self.__notify(*notification)
+
+    def select(self, table: str, statements: dict = None, output_keys: Union[tuple, list] = None):
+        statements = statements or {}
+        self.execute(select_query(table, tuple(output_keys or ()), tuple(statements)), tuple(statements.values()))
+        return self.__fetchone(table)
+
+    def select_all(self, table: str, statements: dict = None, output_keys: Union[tuple, list] = None):
+        statements = statements or {}
+        self.execute(select_query(table, tuple(output_keys or ()), tuple(statements)), tuple(statements.values()))
+        return self.__fetchall(table)
+
+    def query_all(self, query: str, args: Union[tuple, list] = (), table: str = None):
+        self.execute(query, args)
+        return self.__fetchall(table)
+
+    # Построчное чтение больших выборок без загрузки всего результата в память
+    def iterate(self, query: str, args: Union[tuple, list] = (), table: str = None, size: int = 1000):
+        cursor = self.db.cursor()
+        cursor.execute(query, args)
+        make = get_row_class(table, cursor.description)._make
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            for row in rows:
+                yield make(row)
+
+    def execute_many(self, query: str, rows: list):
+        start = time.perf_counter()
+        self.cursor.executemany(query, rows)
+        duration = time.perf_counter() - start
+        for hook in self.__query_hooks:
+            hook(query, duration)
+        self.__commit()
+
+    # Версия таблицы меняется при массовых изменениях, чтобы кэши других процессов их заметили
+    def get_version(self, name: str):
+        row = self.execute('SELECT version FROM versions WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    # Один сигнал подписчикам вместо уведомления на каждую строку
+    def table_changed(self, table: str):
+        self.execute('INSERT INTO versions (name, version) VALUES (?, 1) '
+                     'ON CONFLICT (name) DO UPDATE SET version = version + 1', (table,))
+        self.__commit()
+        self.__notify(table, 'bulk', None)
 
     def update(self, table: str, update_data: dict, statements: dict = None):
-        query = f'UPDATE {table} ' + 'SET {}'
         if not update_data:
             return False
-
-        args_update_str, args_update = self.__select_convert_args(update_data)
-        args = args_update
-        query = query.format(', '.join(args_update_str))
-        if statements:
-            args_states_str, args_states = self.__select_convert_args(statements)
-            query += f' WHERE {" AND ".join(args_states_str)}'
-            args = self.__merge_tuples(args_update, args_states)
-
-        self.__cursor.execute(query, args)
-        self.__db.commit()
+        statements = statements or {}
+        self.execute(update_query(table, tuple(update_data), tuple(statements)),
+                     tuple(update_data.values()) + tuple(statements.values()))
+        self.__commit()
+        self.__notify(table, 'update', update_data, statements or None)
         return True
 
+    # rows - словари с колонкой key, по которой ищется строка; остальные колонки обновляются
+    def update_many(self, table: str, rows: list, key: str = 'id'):
+        with self.transaction():
+            for row in rows:
+                row = dict(row)
+                self.update(table, row, {key: row.pop(key)})
+        return len(rows)
+
     def insert(self, table: str, insert_data: dict):
-        query = f'INSERT INTO {table} ' + '({}) VALUES ({})'
         if not insert_data:
             return None
-        args_str, args = self.__insert_convert_args(insert_data)
-        query = query.format(', '.join(args_str), ', '.join('?'*len(args_str)))
-        self.__cursor.execute(query, args)
-        self.__db.commit()
-        return self.__cursor.lastrowid
+        self.execute(insert_query(table, tuple(insert_data)), tuple(insert_data.values()))
+        self.__commit()
+        row_id = self.cursor.lastrowid
+        self.__notify(table, 'insert', dict(insert_data, id=row_id))
+        return row_id
+
+    def insert_many(self, table: str, rows: list):
+        with self.transaction():
+            return [self.insert(table, dict(row)) for row in rows]
 
     def delete(self, table: str, statements: dict):
-        query = f'DELETE FROM {table} WHERE ' + '{}'
         if not statements:
             return False
-        args_str, args = self.__select_convert_args(statements)
-        query = query.format(' AND '.join(args_str))
-        self.__cursor.execute(query, args)
-        self.__db.commit()
+        self.execute(delete_query(table, tuple(statements)), tuple(statements.values()))
+        self.__commit()
+        self.__notify(table, 'delete', None, statements)
         return True
 
+    # Блокировки между процессами: владелец продлевает блокировку, пока она ему нужна
+    def acquire_lock(self, name: str, owner: str, ttl: float):
+        now = time.time()
+        self.execute('INSERT INTO locks (name, owner, expires) VALUES (?, ?, ?) '
+                            'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+                            'WHERE locks.owner = excluded.owner OR locks.expires < ?',
+                            (name, owner, now + ttl, now))
+        # Блокировка должна сразу стать видна другим процессам
+        self.dirty = False
+        self.db.commit()
+        return self.cursor.rowcount > 0
+
+    def release_lock(self, name: str, owner: str):
+        self.execute('DELETE FROM locks WHERE name = ? AND owner = ?', (name, owner))
+        self.dirty = False
+        self.db.commit()
+        return self.cursor.rowcount > 0
+
+    # Обслуживание: перенос старых заметок в архив и сжатие файла базы
+    def archive_notes(self, before: int, limit: int):
+        # Пачка выбирается подзапросом, чтобы текст запроса не зависел от ее размера.
+        # С ORDER BY id оба подзапроса внутри транзакции выбирают одни и те же заметки
+        batch = 'SELECT id FROM notes WHERE status != 0 OR timeEnd <= ? ORDER BY id LIMIT ?'
+        with self.transaction():
+            self.execute('INSERT OR REPLACE INTO notes_archive '
+                         '(id, text, lesson_id, addition, timeEnd, status, chat_id, archived) '
+                         'SELECT id, text, lesson_id, addition, timeEnd, status, chat_id, ? '
+                         f'FROM notes WHERE id IN ({batch})', (int(time.time()), before, limit))
+            # Подписчиков не уведомляем: в архив попадают только неактивные заметки
+            self.execute(f'DELETE FROM notes WHERE id IN ({batch})', (before, limit))
+            return self.cursor.rowcount
+
+    def file_size(self):
+        page_size = self.execute('PRAGMA page_size').fetchone()[0]
+        return self.execute('PRAGMA page_count').fetchone()[0] * page_size
+
+    # Возвращает, сколько байт освободилось
+    def vacuum(self):
+        self.flush()
+        size = self.file_size()
+        if self.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Режим INCREMENTAL включается только полным VACUUM, дальше хватает incremental_vacuum
+            self.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self.execute('VACUUM')
+        else:
+            # execute выполняет прагму только на один шаг (одну страницу), executescript - до конца
+            self.db.executescript('PRAGMA incremental_vacuum')
+        self.execute('ANALYZE')
+        self.db.commit()
+        self.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return size - self.file_size()
+
     # Уроки
+    # Пары группы и общие для всех групп (group_num = 0)
     def get_lessons(self, group: int = 0, **kwargs):
-        lessons = self.select_all('lessons', kwargs)
-        return list(filter(lambda lesson: lesson.group_num in [0, group], lessons))
+        args_str = conditions('lessons', tuple(kwargs)) + ['group_num IN (0, ?)']
+        args = tuple(kwargs.values()) + (group,)
+        return self.query_all(f'SELECT * FROM lessons WHERE {" AND ".join(args_str)} ORDER BY id', args, 'lessons')
 
     def get_lesson(self, **kwargs):
         return self.select('lessons', kwargs)
@@ -196,13 +467,107 @@ class Database:
     def update_lesson(self, lesson_id: int, **kwargs):
         return self.update('lessons', kwargs, {'id': lesson_id})
 
-    def get_lessons_today(self, group: int = 0):
+    def get_lessons_today(self, group: int = 0, start_year: int = None):
         weekday = self.tm.now.isoweekday()
         semester = self.tm.current_semester
-        grade = self.tm.get_grade()
+        grade = self.tm.get_grade(start_year=start_year)
         all_groups = self.get_lessons(group, weekday=weekday, semester=semester, grade=grade)
         return all_groups
 
+    # Настройки чатов
+    def get_chat_settings(self, chat_id: int):
+        return self.select('chat_settings', {'chat_id': chat_id})
+
+    # defaults пишутся только при первой вставке строки чата, существующие значения они не меняют
+    def set_chat_settings(self, chat_id: int, defaults: dict = None, **kwargs):
+        values = dict(defaults or {}, **kwargs)
+        columns = ('chat_id',) + tuple(values)
+        check_columns('chat_settings', columns)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in kwargs)
+        self.execute(f'INSERT INTO chat_settings ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                     f'ON CONFLICT (chat_id) DO UPDATE SET {updates}', (chat_id,) + tuple(values.values()))
+        self.__commit()
+        self.__notify('chat_settings', 'update', dict(kwargs, chat_id=chat_id), {'chat_id': chat_id})
+        return True
+
+    # Утренняя рассылка: чаты, которым пора ее получить, и которым сегодня еще не отправляли
+    def get_due_digests(self, day: str, now: str, default_time: str):
+        query = 'SELECT chat_settings.* FROM chat_settings ' \
+                'LEFT JOIN digests ON digests.chat_id = chat_settings.chat_id ' \
+                'WHERE chat_settings.digest = 1 AND COALESCE(chat_settings.digest_time, ?) <= ? ' \
+                'AND (digests.day IS NULL OR digests.day < ?)'
+        return self.query_all(query, (default_time, now, day), 'chat_settings')
+
+    # Чат забирается на день атомарно, поэтому рассылку за день получает только один процесс
+    def claim_digests(self, chat_ids: list, day: str):
+        claimed = []
+        with self.transaction():
+            for chat_id in chat_ids:
+                self.execute('INSERT INTO digests (chat_id, day) VALUES (?, ?) '
+                             'ON CONFLICT (chat_id) DO UPDATE SET day = excluded.day WHERE digests.day < excluded.day',
+                             (chat_id, day))
+                if self.cursor.rowcount > 0:
+                    claimed.append(chat_id)
+        return claimed
+
+    def release_digest(self, chat_id: int, day: str):
+        self.execute('DELETE FROM digests WHERE chat_id = ? AND day = ?', (chat_id, day))
+        self.__commit()
+
+    # Опросы и посещаемость
+    def add_poll(self, poll_id: str, chat_id: int, lesson_ids: list):
+        self.execute('INSERT OR IGNORE INTO polls (poll_id, chat_id, lessons, created) VALUES (?, ?, ?, ?)',
+                     (poll_id, chat_id, ','.join(map(str, lesson_ids)), int(time.time())))
+        self.__commit()
+
+    # Счетчики меняются на разницу между прошлым и новым ответом, без пересчета всех голосов
+    def record_poll_answer(self, poll_id: str, user_id: int, option_ids: list):
+        with self.transaction():
+            poll = self.execute('SELECT chat_id, lessons FROM polls WHERE poll_id = ?', (poll_id,)).fetchone()
+            if poll is None:
+                return False
+            chat_id, lessons = poll[0], [int(lesson_id) for lesson_id in poll[1].split(',') if lesson_id]
+
+            def lesson_ids(options):
+                for option in options:
+                    if option < len(lessons):
+                        yield lessons[option]
+                    elif option == len(lessons):
+                        yield from lessons
+                    else:
+                        yield 0
+
+            previous = self.execute('SELECT options FROM poll_answers WHERE poll_id = ? AND user_id = ?',
+                                    (poll_id, user_id)).fetchone()
+            delta = {}
+            for lesson_id in lesson_ids(int(option) for option in (previous[0].split(',') if previous else []) if option):
+                delta[lesson_id] = delta.get(lesson_id, 0) - 1
+            for lesson_id in lesson_ids(option_ids):
+                delta[lesson_id] = delta.get(lesson_id, 0) + 1
+
+            if option_ids:
+                self.execute('INSERT INTO poll_answers (poll_id, user_id, options) VALUES (?, ?, ?) '
+                             'ON CONFLICT (poll_id, user_id) DO UPDATE SET options = excluded.options',
+                             (poll_id, user_id, ','.join(map(str, option_ids))))
+            else:
+                # Пользователь отозвал голос
+                self.execute('DELETE FROM poll_answers WHERE poll_id = ? AND user_id = ?', (poll_id, user_id))
+            for lesson_id, votes in delta.items():
+                if votes:
+                    self.execute('INSERT INTO attendance (chat_id, lesson_id, votes) VALUES (?, ?, ?) '
+                                 'ON CONFLICT (chat_id, lesson_id) DO UPDATE SET votes = votes + excluded.votes',
+                                 (chat_id, lesson_id, votes))
+        return True
+
+    def get_attendance(self, chat_id: int):
+        query = 'SELECT attendance.lesson_id, attendance.votes, lessons.name AS lesson_name FROM attendance ' \
+                'LEFT JOIN lessons ON lessons.id = attendance.lesson_id ' \
+                'WHERE attendance.chat_id = ? ORDER BY attendance.votes DESC'
+        return self.query_all(query, (chat_id,))
+
+    def count_polls(self, chat_id: int):
+        return self.execute('SELECT count(*) FROM polls WHERE chat_id = ?', (chat_id,)).fetchone()[0]
+
     # Пользователи
     def get_users(self, **kwargs):
         return self.select_all('users', kwargs)
@@ -220,7 +585,7 @@ class Database:
         return self.insert('users', kwargs)
 
     def user_registered(self, **kwargs):
-        data = self.select('users', kwargs)
+        data = self.select('users', kwargs, ('id',))
         return bool(data)
 
     # Заметки
@@ -228,16 +593,75 @@ class Database:
         return self.select_all('notes', kwargs)
 
     def get_active_notes(self, **kwargs):
-        current_time = self.tm.timestamp
-        notes = self.get_all_notes(**kwargs)
-        notes = list(filter(lambda note: note.timeEnd > current_time and not(note.status), notes))
-        return notes
+        args_str = conditions('notes', tuple(kwargs)) + ['timeEnd > ? AND status = 0']
+        args = tuple(kwargs.values()) + (self.tm.timestamp,)
+        return self.query_all(f'SELECT * FROM notes WHERE {" AND ".join(args_str)}', args, 'notes')
+
+    # output_keys - нужные колонки заметки, название пары добавляется всегда
+    # after_id - только заметки с id больше него (добавленные после последней проверки)
+    def get_active_notes_with_lessons(self, output_keys: Union[tuple, list] = None, after_id: int = None, **kwargs):
+        check_columns('notes', tuple(output_keys or ()))
+        columns = ', '.join(f'notes.{column}' for column in output_keys) if output_keys else 'notes.*'
+        args_str = conditions('notes', tuple(kwargs), 'notes.') + ['notes.timeEnd > ? AND notes.status = 0']
+        args = tuple(kwargs.values()) + (self.tm.timestamp,)
+        if after_id is not None:
+            args_str.append('notes.id > ?')
+            args += (after_id,)
+        query = f'SELECT {columns}, lessons.name AS lesson_name FROM notes ' \
+                'LEFT JOIN lessons ON lessons.id = notes.lesson_id ' \
+                f'WHERE {" AND ".join(args_str)}'
+        return self.query_all(query, args, 'notes')
+
+    # Страница заметок чата по ключу (timeEnd, id): cursor - ключ последней показанной заметки,
+    # backward - листать назад от него. Берется limit + 1 строка, чтобы узнать, есть ли еще страница
+    def get_notes_page(self, chat_id: int, cursor: tuple = None, backward: bool = False, limit: int = 10):
+        args_str = ['notes.chat_id = ? AND notes.status = 0 AND notes.timeEnd > ?']
+        args = [chat_id, self.tm.timestamp]
+        if cursor:
+            args_str.append(f'(notes.timeEnd, notes.id) {"<" if backward else ">"} (?, ?)')
+            args.extend(cursor)
+        order = 'DESC' if backward else 'ASC'
+        query = 'SELECT notes.*, lessons.name AS lesson_name FROM notes ' \
+                'LEFT JOIN lessons ON lessons.id = notes.lesson_id ' \
+                f'WHERE {" AND ".join(args_str)} ' \
+                f'ORDER BY notes.timeEnd {order}, notes.id {order} LIMIT ?'
+        args.append(limit + 1)
+        notes = self.query_all(query, args, 'notes')
+        has_more = len(notes) > limit
+        notes = notes[:limit]
+        if backward:
+            notes.reverse()
+        return notes, has_more
+
+    # Поиск по тексту активных заметок чата, лучшие совпадения (bm25) первыми.
+    # Слова запроса ищутся по префиксу, чтобы находились другие формы слова
+    def search_notes(self, chat_id: int, text: str, limit: int = 10):
+        words = re.findall(r'\w+', text)
+        if not words:
+            return []
+        match = ' '.join(f'"{word}"*' for word in words)
+        query = 'SELECT notes.*, lessons.name AS lesson_name FROM notes_fts ' \
+                'JOIN notes ON notes.id = notes_fts.rowid ' \
+                'LEFT JOIN lessons ON lessons.id = notes.lesson_id ' \
+                'WHERE notes_fts MATCH ? AND notes.chat_id = ? AND notes.status = 0 AND notes.timeEnd > ? ' \
+                'ORDER BY bm25(notes_fts) LIMIT ?'
+        return self.query_all(query, (match, chat_id, self.tm.timestamp, limit), 'notes')
 
     def get_expired_notes(self, **kwargs):
-        current_time = self.tm.timestamp
-        notes = self.get_all_notes(**kwargs)
-        notes = list(filter(lambda note: note.timeEnd <= current_time or note.status, notes))
-        return notes
+        args_str = conditions('notes', tuple(kwargs)) + ['(timeEnd <= ? OR status != 0)']
+        args = tuple(kwargs.values()) + (self.tm.timestamp,)
+        return self.query_all(f'SELECT * FROM notes WHERE {" AND ".join(args_str)}', args, 'notes')
+
+    # Меняется, когда другие процессы добавляют или удаляют заметки
+    def notes_fingerprint(self):
+        self.execute('SELECT count(*), max(id) FROM notes WHERE status = 0')
+        return tuple(self.cursor.fetchone())
+
+    # Какие из заметок еще активны. Список id передается одним параметром, чтобы текст запроса не менялся
+    def get_active_note_ids(self, note_ids: list):
+        self.execute('SELECT id FROM notes WHERE id IN (SELECT value FROM json_each(?)) AND status = 0 AND timeEnd > ?',
+                     (json.dumps(list(note_ids)), self.tm.timestamp))
+        return [row[0] for row in self.cursor.fetchall()]
 
     def add_note(self, **kwargs):
         return self.insert('notes', kwargs)
@@ -250,5 +674,53 @@ class Database:
 
     def get_note(self, **kwargs):
         return self.select('notes', kwargs)
-    
-    
+
+
+class AsyncDatabase:
+    # Все запросы выполняются в отдельном потоке, чтобы не блокировать event loop бота
+    # commit_interval > 0 включает групповой коммит: записи копятся и сбрасываются раз в commit_interval секунд
+    def __init__(self, db: Database, commit_interval: float = config.db_commit_interval):
+        self.__sync = db
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+        self.commit_interval = commit_interval
+        self.__flush_handle = None
+        db.group_commit = commit_interval > 0
+
+    @property
+    def sync(self):
+        return self.__sync
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.__executor, functools.partial(func, *args, **kwargs))
+        if self.__sync.dirty and self.__flush_handle is None:
+            self.__flush_handle = loop.call_later(self.commit_interval, self.__flush)
+        return result
+
+    def __flush(self):
+        self.__flush_handle = None
+        asyncio.get_running_loop().run_in_executor(self.__executor, self.__sync.flush)
+
+    # Транзакция целиком выполняется в потоке базы: func(db) получает синхронный Database
+    async def transaction(self, func, *args, **kwargs):
+        def run():
+            with self.__sync.transaction():
+                return func(self.__sync, *args, **kwargs)
+        return await self.run(run)
+
+    def __getattr__(self, item):
+        attr = getattr(self.__sync, item)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        return wrapper
+
+    async def close(self):
+        if self.__flush_handle is not None:
+            self.__flush_handle.cancel()
+            self.__flush_handle = None
+        await self.run(self.__sync.close)
+        self.__executor.shutdown(wait=True)
@@ -0,0 +1,70 @@
+import asyncio
+
+from aiogram.utils.exceptions import BadRequest, Unauthorized
+
+import config
+from database import AsyncDatabase
+from sender import Sender
+from time_manager import TimeManager
+from timetable import Timetable
+
+
+class Digest:
+    # Утренняя рассылка пар подписанным чатам. День рассылки по чату хранится в базе (таблица digests),
+    # поэтому после перезапуска бот досылает пропущенное и не отправляет повторно
+    def __init__(self, db: AsyncDatabase, timetable: Timetable, sender: Sender, tm: TimeManager):
+        self.db = db
+        self.timetable = timetable
+        self.sender = sender
+        self.tm = tm
+        self.task = None
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def send_due(self):
+        now = self.tm.now
+        day = now.date().isoformat()
+        chats = await self.db.get_due_digests(day, now.strftime('%H:%M'), config.digest_time)
+        if not chats:
+            return 0
+        claimed = set(await self.db.claim_digests([chat.chat_id for chat in chats], day))
+
+        # Текст дня считается один раз на группу, а не на каждый чат
+        texts = {}
+        messages = []
+        for chat in chats:
+            if chat.chat_id not in claimed:
+                continue
+            key = (chat.group_num, chat.start_year)
+            if key not in texts:
+                texts[key] = await self.timetable.daily_text(chat.group_num, now.isoweekday(), chat.start_year)
+            if texts[key]:
+                messages.append((chat.chat_id, f'☀️ <b>Доброе утро!</b>\n\n{texts[key]}'))
+
+        results = await self.sender.broadcast(messages)
+        sent = 0
+        for (chat_id, _), result in zip(messages, results):
+            if not isinstance(result, Exception):
+                sent += 1
+            elif isinstance(result, (BadRequest, Unauthorized)):
+                # Бота удалили из чата или чат недоступен - повторять бесполезно
+                print(f'[!] DIGEST ERROR: chat {chat_id}:', str(result))
+            else:
+                # Сетевая ошибка после всех повторов - попробуем на следующей проверке
+                await self.db.release_digest(chat_id, day)
+        return sent
+
+    async def run(self):
+        while True:
+            try:
+                await self.send_due()
+            except Exception as e:
+                print('[!] DIGEST ERROR:', str(e))
+            await asyncio.sleep(config.digest_check_interval)
@@ -1,29 +1,107 @@
-import json
+import asyncio
+import time
+from collections import OrderedDict
 
-from database import Database
+import config
+from database import AsyncDatabase
+
+
+class RegistrationCache:
+    # Кэш зарегистрированных пользователей: user_id -> (зарегистрирован, когда устареет)
+    def __init__(self, db: AsyncDatabase, maxsize: int = config.users_cache_size, ttl: float = config.users_cache_ttl):
+        self.loop = None
+        self.db = db
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.users = OrderedDict()
+        # Все пользователи в кэше: отсутствие записи значит, что пользователь не зарегистрирован
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        db.sync.subscribe('users', self.__on_users_changed)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.users),
+                'hit_ratio': self.hits / total if total else 0.0}
+
+    async def preload(self):
+        self.loop = asyncio.get_running_loop()
+        rows = await self.db.query_all('SELECT user_id FROM users LIMIT ?', (self.maxsize + 1,))
+        self.users.clear()
+        for row in rows[:self.maxsize]:
+            self.users[row.user_id] = (True, None)
+        self.complete = len(rows) <= self.maxsize
+
+    def __set(self, user_id: int, registered: bool, expires: float = None):
+        self.users[user_id] = (registered, expires)
+        self.users.move_to_end(user_id)
+        while len(self.users) > self.maxsize:
+            self.users.popitem(last=False)
+            self.complete = False
+
+    # Вызывается из потока базы данных
+    def __on_users_changed(self, action: str, data: dict, statements: dict):
+        if self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self.__apply, action, data, statements)
+
+    def __apply(self, action: str, data: dict, statements: dict):
+        if action == 'insert' and 'user_id' in data:
+            self.__set(data['user_id'], True)
+        elif action == 'delete' and 'user_id' in statements:
+            if self.complete:
+                self.users.pop(statements['user_id'], None)
+            else:
+                self.__set(statements['user_id'], False, time.monotonic() + self.ttl)
+        else:
+            self.users.clear()
+            self.complete = False
+
+    async def registered(self, user_id: int):
+        entry = self.users.get(user_id)
+        if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+            self.hits += 1
+            self.users.move_to_end(user_id)
+            return entry[0]
+        if entry is None and self.complete:
+            self.hits += 1
+            return False
+
+        self.misses += 1
+        registered = await self.db.user_registered(user_id=user_id)
+        self.__set(user_id, registered, time.monotonic() + self.ttl)
+        return registered
 
 
 class Filters:
-    def __init__(self, db: Database):
+    def __init__(self, db: AsyncDatabase):
         self.db = db
+        self.users = RegistrationCache(db)
 
+    # Асинхронные фильтры: aiogram сам дождется результата
     def notRegisteredMessage(self):
-        return lambda message: not(self.db.user_registered(user_id=message.chat.id))
+        async def check(message):
+            return not(await self.users.registered(message.chat.id))
+        return check
 
     def notRegisteredQuery(self):
-        return lambda query: not(self.db.user_registered(user_id=query.message.chat.id))
+        async def check(query):
+            return not(await self.users.registered(query.message.chat.id))
+        return check
 
     def RegisteredMessage(self):
-        return lambda message: self.db.user_registered(user_id=message.chat.id)
+        async def check(message):
+            return await self.users.registered(message.chat.id)
+        return check
 
     def RegisteredQuery(self):
-        return lambda query: self.db.user_registered(user_id=query.message.chat.id)
+        async def check(query):
+            return await self.users.registered(query.message.chat.id)
+        return check
 
     def isPublicMessage(self):
         return lambda message: message.chat.type != 'private'
 
     def isPublicQuery(self):
         return lambda query: query.message.chat.type != 'private'
-
-    def Query(self, query_string: str):
-        return lambda query: json.loads(query.data)['action'] == query_string
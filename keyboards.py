@@ -1,54 +1,52 @@
 from aiogram import types
-import json
-from database import DatabaseObject, Database
+
+import callbacks
+from database import Lesson, AsyncDatabase
 from time_manager import TimeManager
 
 
 class Keyboards:
-    def __init__(self, db: Database, tm: TimeManager):
+    def __init__(self, db: AsyncDatabase, tm: TimeManager):
         self.db = db
         self.tm = TimeManager()
         self.page_elems = 10
 
-    def note_lessons_keyboard(self, lessons: list[DatabaseObject]):
+    def note_lessons_keyboard(self, lessons: list[Lesson]):
         kb = types.InlineKeyboardMarkup(1)
         for lesson in lessons:
-            kb.add(types.InlineKeyboardButton(f'🔹 {lesson.name}', callback_data=json.dumps({'action': 'lesson_note', 'id': lesson.id})))
-        kb.add(types.InlineKeyboardButton('↪️Отмена', callback_data=json.dumps({'action': 'cancel_note'})))
+            kb.add(types.InlineKeyboardButton(f'🔹 {lesson.name}', callback_data=callbacks.lesson_note.new(id=lesson.id)))
+        kb.add(types.InlineKeyboardButton('↪️Отмена', callback_data=callbacks.cancel_note.new()))
         return kb
 
-    def __page_system(self, callback: str, list: list, page: int = 0, **kwargs):
+    # Кнопки листания несут ключ крайней заметки страницы, а не смещение
+    def __page_system(self, callback: callbacks.Callback, notes: list, page: int = 0,
+                      has_prev: bool = False, has_next: bool = False):
         buttons = []
-        list_cut = list[(page*self.page_elems):((page+1)*self.page_elems)]
-        if page > 0:
-            callback_data = {'action': callback, 'page': page-1}
-            if kwargs:
-                callback_data.update(**kwargs)
-            buttons.append(types.InlineKeyboardButton(f'⬅️ {page}', callback_data=json.dumps(callback_data)))
-        if len(list) > len(list_cut)*(page+1):
-            callback_data = {'action' : callback, 'page' : page + 1}
-            if kwargs :
-                callback_data.update(**kwargs)
-            buttons.append(types.InlineKeyboardButton(f'⬅️ {page+2}', callback_data=json.dumps(callback_data)))
-
-        return list_cut, buttons
+        if has_prev:
+            first = notes[0]
+            callback_data = callback.new(page=page-1, direction='p', time=first.timeEnd, id=first.id)
+            buttons.append(types.InlineKeyboardButton(f'⬅️ {page}', callback_data=callback_data))
+        if has_next:
+            last = notes[-1]
+            callback_data = callback.new(page=page+1, direction='n', time=last.timeEnd, id=last.id)
+            buttons.append(types.InlineKeyboardButton(f'➡️ {page+2}', callback_data=callback_data))
+        return buttons
 
     def cancel_note_keyboard(self):
         kb = types.InlineKeyboardMarkup(1)
-        kb.add(types.InlineKeyboardButton('↪️Отмена', callback_data=json.dumps({'action': 'cancel_note'})))
+        kb.add(types.InlineKeyboardButton('↪️Отмена', callback_data=callbacks.cancel_note.new()))
         return kb
 
-    def notes_menu_keyboard(self, notes: list, page: int = 0):
+    def notes_menu_keyboard(self, notes: list, page: int = 0, has_prev: bool = False, has_next: bool = False):
         kb = types.InlineKeyboardMarkup(2)
-        notes, buttons = self.__page_system('view_notes', notes, page)
+        buttons = self.__page_system(callbacks.view_notes, notes, page, has_prev, has_next)
         for note in notes:
-            lesson = self.db.get_lesson(id=note.lesson_id)
-            kb.add(types.InlineKeyboardButton(f'{lesson.name} до {self.tm.strftime(note.timeEnd)}', callback_data=json.dumps({'action': 'view_note', 'id': note.id})))
+            kb.add(types.InlineKeyboardButton(f'{note.lesson_name or "??"} до {self.tm.strftime(note.timeEnd)}', callback_data=callbacks.view_note.new(id=note.id)))
         kb.add(*buttons)
         return kb
 
     def note_menu_keyboard(self, note_id: int):
         kb = types.InlineKeyboardMarkup()
-        kb.add(types.InlineKeyboardButton('🗑 Удалить', callback_data=json.dumps({'action': 'delete_note', 'id': note_id})))
-        kb.add(types.InlineKeyboardButton('↪️ Назад', callback_data=json.dumps({'action': 'view_notes', 'page': 0})))
+        kb.add(types.InlineKeyboardButton('🗑 Удалить', callback_data=callbacks.delete_note.new(id=note_id)))
+        kb.add(types.InlineKeyboardButton('↪️ Назад', callback_data=callbacks.view_notes.new(page=0)))
         return kb
@@ -0,0 +1,206 @@
+import argparse
+import csv
+import itertools
+import json
+import re
+import sys
+import time
+
+import config
+from database import Database, Lesson, insert_query, update_query
+
+# Загрузка и выгрузка расписания (таблица lessons) в CSV или JSON Lines:
+#   python lessons_io.py export lessons.csv
+#   python lessons_io.py import lessons.jsonl --diff
+# Строки читаются и проверяются потоково, пишутся пачками в одной транзакции на пачку
+
+columns = tuple(field for field in Lesson._fields if field != 'id')
+required = ('name', 'weekday', 'time', 'grade', 'semester')
+defaults = {'room_number': 0, 'teacher': '', 'group_num': 0}
+time_format = re.compile(r'^([01]?\d|2[0-3]):[0-5]\d$')
+
+
+def file_format(path: str, fmt: str = None):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+
+
+# Строки JSON отдаются как есть и разбираются в valid_rows, чтобы битая строка стала ошибкой строки
+def read_rows(file, fmt: str):
+    if fmt == 'csv':
+        for row in csv.DictReader(file):
+            yield {key: value for key, value in row.items() if value not in (None, '')}
+    else:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def to_int(value, name: str, low: int = None, high: int = None):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ValueError(f'{name} out of range: {value}')
+    return value
+
+
+def validate(row):
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError as e:
+            raise ValueError(f'invalid JSON: {e}')
+    if not isinstance(row, dict):
+        raise ValueError(f'row must be an object, got {type(row).__name__}')
+    missing = [name for name in required if row.get(name) in (None, '')]
+    if missing:
+        raise ValueError(f'missing {", ".join(missing)}')
+    unknown = set(row) - set(Lesson._fields)
+    if unknown:
+        raise ValueError(f'unknown columns {", ".join(sorted(unknown))}')
+    lesson = dict(defaults, **row)
+    lesson['name'] = str(lesson['name']).strip()
+    lesson['teacher'] = str(lesson['teacher']).strip()
+    if not time_format.match(str(lesson['time'])):
+        raise ValueError(f'time must be HH:MM, got {lesson["time"]}')
+    lesson['weekday'] = to_int(lesson['weekday'], 'weekday', 1, 7)
+    lesson['grade'] = to_int(lesson['grade'], 'grade', 1)
+    lesson['semester'] = to_int(lesson['semester'], 'semester', 0, 2)
+    lesson['group_num'] = to_int(lesson['group_num'], 'group_num', 0)
+    room = str(lesson['room_number']).strip()
+    lesson['room_number'] = int(room) if room.isdigit() else room
+    if 'id' in lesson:
+        lesson['id'] = to_int(lesson['id'], 'id', 1)
+    return lesson
+
+
+def report(errors: list, line: int, message):
+    errors.append(line)
+    print(f'[!] IMPORT ERROR: row {line}: {message}')
+
+
+def valid_rows(rows, errors: list):
+    for line, row in enumerate(rows, start=1):
+        try:
+            yield line, validate(row)
+        except ValueError as e:
+            report(errors, line, e)
+
+
+def batches(rows, size: int):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Строка без id сопоставляется с существующей парой по слоту расписания и названию
+def slot(lesson):
+    return (lesson['grade'], lesson['semester'], lesson['group_num'], lesson['weekday'], lesson['time'],
+            str(lesson['name']).strip())
+
+
+def import_lessons(db: Database, rows, diff: bool = False, batch_size: int = 1000):
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': 0}
+    errors = []
+    existing, slots = {}, {}
+    if diff:
+        for lesson in db.iterate('SELECT * FROM lessons', table='lessons'):
+            existing[lesson.id] = tuple(getattr(lesson, name) for name in columns)
+            slots[slot(lesson._asdict())] = lesson.id
+    else:
+        # Без --diff строки только добавляются, поэтому занятые id - ошибка строки
+        existing = {lesson.id: None for lesson in db.iterate('SELECT id FROM lessons', table='lessons')}
+
+    insert = insert_query('lessons', columns)
+    insert_with_id = insert_query('lessons', ('id',) + columns)
+    update = update_query('lessons', columns, ('id',))
+    for batch in batches(valid_rows(rows, errors), batch_size):
+        inserts, inserts_with_id, updates = [], [], []
+        for line, lesson in batch:
+            values = tuple(lesson[name] for name in columns)
+            lesson_id = lesson.get('id')
+            if diff and lesson_id is None:
+                # Каждая существующая пара сопоставляется не больше одного раза
+                lesson_id = slots.pop(slot(lesson), None)
+            if not diff and lesson_id in existing:
+                report(errors, line, f'id {lesson_id} already exists, use --diff to update it')
+            elif not diff or lesson_id not in existing:
+                if lesson_id is None:
+                    inserts.append(values)
+                else:
+                    inserts_with_id.append((lesson_id,) + values)
+                    existing[lesson_id] = values
+            elif existing[lesson_id] != values:
+                updates.append(values + (lesson_id,))
+                existing[lesson_id] = values
+            else:
+                stats['unchanged'] += 1
+        with db.transaction():
+            if inserts:
+                db.execute_many(insert, inserts)
+            if inserts_with_id:
+                db.execute_many(insert_with_id, inserts_with_id)
+            if updates:
+                db.execute_many(update, updates)
+        stats['inserted'] += len(inserts) + len(inserts_with_id)
+        stats['updated'] += len(updates)
+
+    stats['errors'] = len(errors)
+    # Кэши расписания сбрасываются один раз на всю загрузку
+    if stats['inserted'] or stats['updated']:
+        db.table_changed('lessons')
+    return stats
+
+
+def export_lessons(db: Database, file, fmt: str):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(Lesson._fields)
+    for lesson in db.iterate('SELECT * FROM lessons ORDER BY id', table='lessons'):
+        if fmt == 'csv':
+            writer.writerow(lesson)
+        else:
+            file.write(json.dumps(lesson._asdict(), ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Загрузка и выгрузка расписания')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('path', help='файл .csv или .jsonl, "-" - stdin/stdout')
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help='формат файла (по умолчанию по расширению)')
+    parser.add_argument('--diff', action='store_true',
+                        help='обновить совпавшие пары (по id или по слоту и названию), добавить только новые')
+    parser.add_argument('--batch', type=int, default=1000, help='строк в одной транзакции')
+    parser.add_argument('--db', default=config.db_path)
+    args = parser.parse_args()
+
+    fmt = file_format(args.path, args.format)
+    db = Database(args.db)
+    start = time.perf_counter()
+    try:
+        if args.action == 'export':
+            file = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8', newline='')
+            with file:
+                count = export_lessons(db, file, fmt)
+            print(f'[*] Export: {count} lessons in {time.perf_counter() - start:.2f} s', file=sys.stderr)
+        else:
+            file = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', newline='')
+            with file:
+                stats = import_lessons(db, read_rows(file, fmt), args.diff, args.batch)
+            print(f'[*] Import: {stats["inserted"]} inserted, {stats["updated"]} updated, '
+                  f'{stats["unchanged"]} unchanged, {stats["errors"]} errors in {time.perf_counter() - start:.2f} s')
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,45 @@
-import json
-
 from aiogram import Bot, Dispatcher, executor, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 import filters
 import config
 import keyboards
+import callbacks
 from checkers import Checkers
-from database import Database
+from chats import ChatSettingsCache
+from digest import Digest
+from maintenance import Maintenance
+from sender import Sender
+from storage import SQLiteStorage
+from database import Database, AsyncDatabase
 import asyncio
 import random
+import time
 
 from time_manager import TimeManager
+from timetable import Timetable
+import webhook
+import metrics
 
 app = Bot(token=config.botToken, parse_mode=types.ParseMode.HTML)
-storage = MemoryStorage()
+storage = SQLiteStorage(config.db_path)
 dp = Dispatcher(bot=app, storage=storage)
-db = Database(config.db_path)
+db = AsyncDatabase(Database(config.db_path))
 filters = filters.Filters(db)
 tm = TimeManager()
 kbs = keyboards.Keyboards(db, tm)
-ck = Checkers(app, db)
+router = callbacks.CallbackRouter()
+timetable = Timetable(db, tm)
+chats = ChatSettingsCache(db)
+sender = Sender(app)
+ck = Checkers(app, db, sender)
+maintenance = Maintenance(db, tm)
+digest = Digest(db, timetable, sender, tm)
+metrics_server = metrics.MetricsServer(metrics.SamplingProfiler() if config.profiler_enabled else None)
+if config.metrics_enabled:
+    dp.middleware.setup(metrics.HandlerMetrics())
+    db.sync.add_query_hook(metrics.record_query)
+    metrics.cache_gauge({'users': filters.users, 'timetable': timetable, 'chats': chats})
 
 class Notes(StatesGroup):
     text = State()
@@ -37,9 +55,65 @@ async def help(message: types.Message):
 /daily - <code>пары сегодня</code>.
 /vote - <code>голосование на пары</code>.
 /week - <code>пары на текущей неделе</code>.
+/setgroup [группа] [год_поступления] - <code>выбрать группу этого чата</code>.
+/digest [on|off] [ЧЧ:ММ] - <code>пары на день каждое утро</code>.
+/stats - <code>посещаемость по опросам /vote</code>.
+/find [текст] - <code>найти заметку</code>.
 '''
     await message.reply(text)
 
+@dp.message_handler(filters.isPublicMessage(), commands=['setgroup'])
+async def set_group(message: types.Message):
+    try:
+        args = [int(arg) for arg in message.get_args().split()]
+        if not args or len(args) > 2 or args[0] < 0:
+            settings = await chats.get(message.chat.id)
+            text = f'👥 <b>Группа чата</b>: <code>{settings.group_num}</code>\n\n' \
+                   'Пример: <code>/setgroup 2 2021</code>'
+            return await message.reply(text)
+        kwargs = {'group_num': args[0]}
+        if len(args) == 2:
+            kwargs['start_year'] = args[1]
+        await chats.set(message.chat.id, **kwargs)
+        text = f'✅ <b>Теперь в этом чате расписание группы</b> <code>{args[0]}</code>'
+    except ValueError:
+        text = '❤️ <b>Группа и год должны быть числами.</b>'
+    except:
+        text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
+    await message.reply(text)
+
+@dp.message_handler(filters.isPublicMessage(), commands=['digest'])
+async def set_digest(message: types.Message):
+    try:
+        args = message.get_args().split()
+        if not args or args[0] not in ('on', 'off') or len(args) > 2:
+            settings = await chats.get(message.chat.id)
+            state = f'включена, в {settings.digest_time or config.digest_time}' if settings.digest else 'выключена'
+            text = f'☀️ <b>Утренняя рассылка</b> {state}\n\nПример: <code>/digest on 07:30</code>'
+            return await message.reply(text)
+        kwargs = {'digest': int(args[0] == 'on')}
+        if len(args) == 2:
+            kwargs['digest_time'] = time.strftime('%H:%M', time.strptime(args[1], '%H:%M'))
+        await chats.set(message.chat.id, **kwargs)
+        text = '✅ <b>Утренняя рассылка включена!</b>' if kwargs['digest'] else '💤 <b>Утренняя рассылка выключена!</b>'
+    except ValueError:
+        text = '❤️ <b>Время нужно писать как</b> <code>07:30</code>'
+    except:
+        text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
+    await message.reply(text)
+
+# Пары курса и семестра группы этого чата. На каникулах или если расписание на этот курс
+# еще не загружено - все пары группы, как раньше, чтобы заметку всегда было к чему привязать
+async def chat_lessons(chat_id: int):
+    settings = await chats.get(chat_id)
+    semester = tm.current_semester
+    if semester is not None:
+        grade = tm.get_grade(start_year=settings.start_year)
+        lessons = await db.get_lessons(settings.group_num, grade=grade, semester=semester)
+        if lessons:
+            return lessons
+    return await db.get_lessons(settings.group_num)
+
 @dp.message_handler(filters.isPublicMessage(), commands=['random'])
 async def random_number(message: types.Message):
     try:
@@ -59,34 +133,65 @@ async def random_number(message: types.Message):
 @dp.message_handler(filters.isPublicMessage(), commands=['notes'])
 async def notes(message: types.Message):
     try:
-        notes = db.get_active_notes(chat_id=message.chat.id)
+        notes, has_next = await db.get_notes_page(message.chat.id, limit=kbs.page_elems)
         if not notes:
             text = '🕐 <b>Напоминаний пока что нет!</b>'
             return await message.reply(text)
 
         text = '💬 <b>Все напоминания</b>:\n\n'
-        kb = kbs.notes_menu_keyboard(notes, 0)
+        kb = kbs.notes_menu_keyboard(notes, 0, has_next=has_next)
         return await message.reply(text, reply_markup=kb)
     except:
         text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
         await message.reply(text)
 
 
-@dp.callback_query_handler(filters.isPublicQuery(), filters.Query('view_notes'))
-async def view_notes(query: types.CallbackQuery):
-    data = json.loads(query.data)
+@dp.message_handler(filters.isPublicMessage(), commands=['find'])
+async def find_notes(message: types.Message):
     try:
-        page = data['page']
+        query = message.get_args()
+        if not query:
+            text = '🔎 <b>Что ищем?</b>\n\nПример: <code>/find курсовая</code>'
+            return await message.reply(text)
+        notes = await db.search_notes(message.chat.id, query, kbs.page_elems)
+        if not notes:
+            text = '🕐 <b>Ничего не нашлось!</b>'
+            return await message.reply(text)
+
+        text = '🔎 <b>Найденные заметки</b>:\n\n'
+        text += '\n'.join(f'{index+1}. <b>{note.lesson_name or "??"}</b> - <code>{note.text}</code>' for index, note in enumerate(notes))
+        kb = kbs.notes_menu_keyboard(notes)
+        return await message.reply(text, reply_markup=kb)
     except:
-        page = 0
+        text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
+        await message.reply(text)
+
+
+@router.route(callbacks.view_notes)
+async def view_notes(query: types.CallbackQuery, data: dict, state: FSMContext):
+    page = data.get('page', 0)
+    backward = data.get('direction') == 'p'
+    cursor = (data['time'], data['id']) if 'id' in data else None
     try:
-        notes = db.get_active_notes(chat_id=query.message.chat.id)
+        notes, has_more = await db.get_notes_page(query.message.chat.id, cursor, backward, kbs.page_elems)
+        if not notes and cursor:
+            # Заметки с той стороны ключа истекли или удалены - показываем первую страницу
+            page, backward = 0, False
+            notes, has_more = await db.get_notes_page(query.message.chat.id, limit=kbs.page_elems)
         if not notes:
             text = '🕐 <b>Напоминаний пока что нет!</b>'
             return await app.edit_message_text(text, chat_id=query.message.chat.id, message_id=query.message.message_id)
 
+        if backward:
+            has_prev, has_next = has_more, True
+            if not has_more:
+                page = 0
+        else:
+            if cursor is None:
+                page = 0
+            has_prev, has_next = cursor is not None, has_more
         text = '💬 <b>Все напоминания</b>:\n\n'
-        kb = kbs.notes_menu_keyboard(notes, page)
+        kb = kbs.notes_menu_keyboard(notes, page, has_prev, has_next)
         return await app.edit_message_text(text, chat_id=query.message.chat.id, message_id=query.message.message_id, reply_markup=kb)
 
     except:
@@ -94,15 +199,14 @@ async def view_notes(query: types.CallbackQuery):
         return await app.edit_message_text(text, chat_id=query.message.chat.id, message_id=query.message.message_id)
 
 
-@dp.callback_query_handler(filters.Query('view_note'), filters.isPublicQuery())
-async def view_note(query: types.CallbackQuery):
-    data = json.loads(query.data)
+@router.route(callbacks.view_note)
+async def view_note(query: types.CallbackQuery, data: dict, state: FSMContext):
     try:
-        note = db.get_note(id=data['id'])
+        note = await db.get_note(id=data['id'])
         if not note:
             text = '<b>Запрашиваемая Вами заметка не найдена!</b>'
             return await app.edit_message_text(text, chat_id=query.message.chat.id, message_id=query.message.message_id)
-        lesson = db.get_lesson(id=note.lesson_id)
+        lesson = await db.select('lessons', {'id': note.lesson_id}, ('name',))
         if not lesson:
             lesson_name = '??'
         else:
@@ -128,10 +232,10 @@ async def add_note(message: types.Message, state: FSMContext):
     await Notes.text.set()
     return await message.reply(text, reply_markup=kbs.cancel_note_keyboard())
 
-@dp.callback_query_handler(filters.Query('cancel_note'), filters.isPublicQuery(), state=Notes)
-async def cancel_note(query: types.CallbackQuery):
+@router.route(callbacks.cancel_note, state=Notes)
+async def cancel_note(query: types.CallbackQuery, data: dict, state: FSMContext):
     try:
-        await dp.current_state().finish()
+        await state.finish()
         await app.delete_message(query.message.chat.id, query.message.message_id)
     except:
         pass
@@ -139,15 +243,14 @@ async def cancel_note(query: types.CallbackQuery):
     await query.message.answer(text)
 
 
-@dp.callback_query_handler(filters.Query('delete_note'), filters.isPublicQuery())
-async def delete_note(query: types.CallbackQuery):
-    data = json.loads(query.data)
+@router.route(callbacks.delete_note)
+async def delete_note(query: types.CallbackQuery, data: dict, state: FSMContext):
     try:
-        note = db.get_note(id=data['id'])
+        note = await db.select('notes', {'id': data['id']}, ('id',))
         if not note:
             text = '📛 <b>Запрашиваемая Вами заметка не найдена!</b>'
             return await app.edit_message_text(text, chat_id=query.message.chat.id, message_id=query.message.message_id)
-        delete = db.update_note(data['id'], status=1)
+        delete = await db.update_note(data['id'], status=1)
         text = f'✅ <b>Заметка</b> <code>№{note.id}</code> <b>успешно удалена!</b>'
         return await app.edit_message_text(text, chat_id=query.message.chat.id, message_id=query.message.message_id)
     except Exception as e:
@@ -161,7 +264,7 @@ async def add_note_text(message: types.Message, state: FSMContext):
         text = message.text
         await state.update_data(note_text=text)
         text = f'🔻 <b>Теперь выберите пару, по которой хотите создать заметку: </b>'
-        lessons = db.get_lessons(config.graduate_group)
+        lessons = await chat_lessons(message.chat.id)
         kb = kbs.note_lessons_keyboard(lessons)
         #state = dp.current_state(chat=message.chat.id, user=message.from_user.id)
         await Notes.next()
@@ -175,14 +278,13 @@ async def add_note_text(message: types.Message, state: FSMContext):
         text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
         await message.answer(text)
 
-@dp.callback_query_handler(filters.Query('lesson_note'), filters.isPublicQuery(), state=Notes.lesson)
-async def choose_note_lesson(query: types.CallbackQuery, state: FSMContext):
+@router.route(callbacks.lesson_note, state=Notes.lesson)
+async def choose_note_lesson(query: types.CallbackQuery, data: dict, state: FSMContext):
     try:
-        data = json.loads(query.data)
-        lesson = db.get_lesson(id=data['id'])
+        lesson = await db.get_lesson(id=data['id'])
         await app.delete_message(query.message.chat.id, query.message.message_id)
         if not lesson:
-            lessons = db.get_lessons(config.graduate_group)
+            lessons = await chat_lessons(query.message.chat.id)
             kb = kbs.note_lessons_keyboard(lessons)
             text = '‼️ <b>Такого урока не существует!</b>\n\nВыбирай заново:'
             return await query.message.answer(text, reply_markup=kb)
@@ -219,7 +321,7 @@ async def note_date(message: types.Message, state: FSMContext):
         pass
     try:
         date = tm.string_to_date(message.text)
-        id = db.add_note(text=data['note_text'], timeEnd=date.timestamp(), lesson_id=data['note_lesson'], chat_id=message.chat.id)
+        id = await db.add_note(text=data['note_text'], timeEnd=date.timestamp(), lesson_id=data['note_lesson'], chat_id=message.chat.id)
         text = f'✅ <b>Заметка №{id} успешно добавлена!</b>'
         return await message.reply(text)
     except:
@@ -234,23 +336,8 @@ async def note_date(message: types.Message, state: FSMContext):
 @dp.message_handler(filters.isPublicMessage(), commands=['week'])
 async def lessons_weekly(message: types.Message):
     try:
-        lessons = db.get_lessons(group=config.graduate_group)
-        lessons = sorted(lessons, key=lambda key: key.id and key.weekday)
-        min_weekday = min(lessons, key=lambda elem: elem.weekday).weekday
-        max_weekday = max(lessons, key=lambda elem: elem.weekday).weekday
-        sorted_lessons = []
-        for weekday in range(min_weekday, max_weekday+1):
-            elem = list(filter(lambda element: element.weekday == weekday, lessons))
-            sorted_lessons.append(elem)
-        text = f'♿️ <b>Все пары на этой неделе</b>:\n\n'
-        for index, week_lessons in enumerate(sorted_lessons):
-            text += f'🔎 <b>{tm.get_weekday_string(index+1)}</b>:\n'
-            if not week_lessons:
-                text += '💤 <i>Пар нет...</i>'
-            else:
-                lessons = [f'{week_lessons.index(lesson)+1}. {lesson.name} - <code>{lesson.room_number} каб.</code> ({lesson.time})' for lesson in week_lessons]
-                text += '\n'.join(lessons)
-            text += '\n\n'
+        settings = await chats.get(message.chat.id)
+        text = await timetable.week_text(settings.group_num, settings.start_year)
         await message.answer(text)
     except:
         text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
@@ -259,7 +346,8 @@ async def lessons_weekly(message: types.Message):
 @dp.message_handler(filters.isPublicMessage(), commands=['vote'])
 async def vote_for_lessons(message: types.Message):
     try:
-        lessons = db.get_lessons_today(config.graduate_group)
+        settings = await chats.get(message.chat.id)
+        lessons = await timetable.get_lessons_today(settings.group_num, settings.start_year)
         if not lessons:
             text = '💤 <b>Сегодня нет пар, дурак...</b>'
             return await message.reply(text)
@@ -267,7 +355,34 @@ async def vote_for_lessons(message: types.Message):
         options = [f'Только на "{lesson.name}"' for lesson in lessons]
         options.append('На все пары')
         options.append('Нахуй надо')
-        await app.send_poll(message.chat.id, quest, options, is_anonymous=False)
+        poll_message = await app.send_poll(message.chat.id, quest, options, is_anonymous=False)
+        await db.add_poll(poll_message.poll.id, message.chat.id, [lesson.id for lesson in lessons])
+    except:
+        text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
+        await message.answer(text)
+
+@dp.poll_answer_handler()
+async def poll_answer(answer: types.PollAnswer):
+    try:
+        await db.record_poll_answer(answer.poll_id, answer.user.id, answer.option_ids)
+    except Exception as e:
+        print('[!] POLL ANSWER ERROR:', str(e))
+
+@dp.message_handler(filters.isPublicMessage(), commands=['stats'])
+async def attendance_stats(message: types.Message):
+    try:
+        rows = await db.get_attendance(message.chat.id)
+        lessons = [row for row in rows if row.lesson_id and row.votes > 0]
+        skips = sum(row.votes for row in rows if not row.lesson_id)
+        if not lessons and not skips:
+            text = '📊 <b>Голосов пока нет!</b>\n\nЗапустите опрос командой /vote'
+            return await message.reply(text)
+        polls = await db.count_polls(message.chat.id)
+        text = f'📊 <b>Посещаемость</b> (опросов: <code>{polls}</code>):\n\n'
+        text += '\n'.join(f'{index + 1}. {row.lesson_name or "??"} - <code>{row.votes}</code>'
+                          for index, row in enumerate(lessons))
+        text += f'\n\n💤 <b>Не пошли</b>: <code>{skips}</code>'
+        await message.reply(text)
     except:
         text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
         await message.answer(text)
@@ -275,20 +390,56 @@ async def vote_for_lessons(message: types.Message):
 @dp.message_handler(filters.isPublicMessage(), commands=['daily'])
 async def lessons_daily(message: types.Message):
     try:
-        weekday = tm.now.isoweekday()
-        lessons = db.get_lessons_today(2)
-        if not lessons:
+        settings = await chats.get(message.chat.id)
+        text = await timetable.daily_text(settings.group_num, start_year=settings.start_year)
+        if not text:
             text = '💤 <b>Сегодня нет пар, дурак...</b>'
             return await message.reply(text)
-        lessons = sorted(lessons, key=lambda key: key.id)
-        lessons = [
-            f'{lessons.index(lesson) + 1}. {lesson.name} - <code>{lesson.room_number} каб.</code> ({lesson.time})'
-            for lesson in lessons]
-        lessons = '\n'.join(lessons)
-        text = f'♿️ <b>Пары в {tm.get_weekday_string(weekday)}</b>:\n\n{lessons}'
         await message.answer(text)
     except:
         text = '📛 <b>Упс :(</b>\n\nЧто-то пошло не по плану...'
         await message.answer(text)
 
-executor.start_polling(dp, fast=True)
\ No newline at end of file
+router.setup(dp, filters.isPublicQuery())
+
+async def timed(name: str, coro):
+    start = time.perf_counter()
+    await coro
+    return name, time.perf_counter() - start
+
+# Подсистемы запускаются здесь, а не при импорте модулей
+async def start_subsystems(reminders: bool = True, metrics: bool = config.metrics_enabled,
+                           metrics_port: int = config.metrics_port):
+    start = time.perf_counter()
+    timings = [await timed('database', db.connect())]
+    phases = [
+        timed('timetable', timetable.load()),
+        timed('users', filters.users.preload()),
+        timed('chats', chats.preload()),
+    ]
+    if reminders:
+        phases.append(timed('notes', ck.start()))
+        phases.append(timed('maintenance', maintenance.start()))
+        phases.append(timed('digest', digest.start()))
+    if metrics:
+        phases.append(timed('metrics', metrics_server.start(port=metrics_port)))
+    timings += await asyncio.gather(*phases)
+    timings.append(('total', time.perf_counter() - start))
+    print('[*] Startup:', ', '.join(f'{name} {duration * 1000:.1f} ms' for name, duration in timings))
+
+async def on_startup(dp: Dispatcher):
+    await start_subsystems()
+
+async def on_shutdown(dp: Dispatcher):
+    await metrics_server.stop()
+    await digest.stop()
+    await maintenance.stop()
+    await ck.stop()
+    await sender.close()
+    await db.close()
+
+if __name__ == '__main__':
+    if config.mode == 'webhook':
+        webhook.start_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, fast=True, on_startup=on_startup, on_shutdown=on_shutdown)
\ No newline at end of file
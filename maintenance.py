@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import config
+import metrics
+from database import AsyncDatabase
+from time_manager import TimeManager
+
+
+class Maintenance:
+    # Фоновое обслуживание базы: архив старых заметок и сжатие файла в тихий час
+    def __init__(self, db: AsyncDatabase, tm: TimeManager):
+        self.db = db
+        self.tm = tm
+        self.task = None
+        self.vacuum_day = None
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def archive(self):
+        before = int(time.time() - config.archive_after)
+        total = 0
+        while True:
+            count = await self.db.archive_notes(before, config.archive_batch_size)
+            total += count
+            if count < config.archive_batch_size:
+                break
+            # Между пачками пропускаем вперед запросы обработчиков
+            await asyncio.sleep(0)
+        metrics.archived_notes.inc(amount=total)
+        return total
+
+    async def vacuum(self):
+        start = time.perf_counter()
+        reclaimed = await self.db.vacuum()
+        metrics.reclaimed_bytes.inc(amount=max(reclaimed, 0))
+        print(f'[*] Maintenance: vacuum reclaimed {reclaimed / 1024:.1f} KB in {time.perf_counter() - start:.1f} s')
+        return reclaimed
+
+    async def run(self):
+        while True:
+            try:
+                archived = await self.archive()
+                if archived:
+                    print(f'[*] Maintenance: archived {archived} notes')
+                now = self.tm.now
+                if now.hour == config.maintenance_hour and self.vacuum_day != now.date():
+                    self.vacuum_day = now.date()
+                    await self.vacuum()
+            except Exception as e:
+                print('[!] MAINTENANCE ERROR:', str(e))
+            # Тихий час не пропускаем, даже если интервал архивации больше часа
+            await asyncio.sleep(min(config.archive_interval, 30*60))
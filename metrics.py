@@ -0,0 +1,227 @@
+import bisect
+import collections
+import sys
+import threading
+import time
+import traceback
+
+from aiohttp import web
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import config
+
+
+def escape(value: str):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ''):
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = collections.defaultdict(float)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        # Запросы считаются в потоке базы данных, поэтому обходим копию
+        for labels, value in list(self.values.items()):
+            lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.counts = {}
+        self.sums = collections.defaultdict(float)
+
+    def observe(self, value: float, *labels):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, counts in list(self.counts.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, labels, le)} {total}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {self.sums[labels]}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {total}')
+        return lines
+
+
+class Gauge:
+    # Значение считывается функцией в момент запроса метрик: func() -> {labels: value}
+    def __init__(self, name: str, help: str, func, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labels = labels
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for labels, value in self.func().items():
+            lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+handler_latency = registry.register(Histogram('bot_handler_seconds', 'Handler latency', ('handler',)))
+queries = registry.register(Counter('bot_db_queries_total', 'Database queries by statement', ('query',)))
+query_seconds = registry.register(Counter('bot_db_query_seconds_total', 'Database time by statement', ('query',)))
+reminder_sweep = registry.register(Histogram('bot_reminder_sweep_seconds', 'Reminder sweep duration'))
+archived_notes = registry.register(Counter('bot_archived_notes_total', 'Notes moved to the archive'))
+reclaimed_bytes = registry.register(Counter('bot_reclaimed_bytes_total', 'Bytes reclaimed by vacuum'))
+
+
+def record_query(query: str, duration: float):
+    query = ' '.join(query.split())
+    queries.inc(query)
+    query_seconds.inc(query, amount=duration)
+
+
+def cache_gauge(caches: dict):
+    # caches: имя -> объект с методом stats()
+    def collect():
+        values = {}
+        for name, cache in caches.items():
+            stats = cache.stats()
+            values[(name, 'hits')] = stats['hits']
+            values[(name, 'misses')] = stats['misses']
+            values[(name, 'hit_ratio')] = stats['hit_ratio']
+        return values
+    return registry.register(Gauge('bot_cache', 'Cache hits, misses and hit ratio', collect, ('cache', 'stat')))
+
+
+class HandlerMetrics(BaseMiddleware):
+    # Время от прохождения фильтров до завершения обработчика
+    def __start(self, data: dict):
+        handler = current_handler.get(None)
+        data['metrics_handler'] = getattr(handler, '__name__', 'unknown')
+        data['metrics_start'] = time.perf_counter()
+
+    def __finish(self, data: dict, name: str = None):
+        start = data.pop('metrics_start', None)
+        if start is not None:
+            handler_latency.observe(time.perf_counter() - start, name or data.pop('metrics_handler'))
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self.__start(data)
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict):
+        self.__finish(data)
+
+    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        self.__start(data)
+
+    async def on_post_process_callback_query(self, query: types.CallbackQuery, results: list, data: dict):
+        # Все нажатия проходят через CallbackRouter, поэтому подписываем их по action
+        data_string = query.data or ''
+        action = 'legacy' if data_string.startswith('{') else data_string.split(':', 1)[0]
+        self.__finish(data, f'callback:{action}')
+
+
+class SamplingProfiler:
+    # Раз в interval секунд снимает стек основного потока и считает самые частые
+    def __init__(self, interval: float = config.profiler_interval, depth: int = 8):
+        self.interval = interval
+        self.depth = depth
+        self.samples = collections.Counter()
+        self.thread_id = threading.main_thread().ident
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            threading.Thread(target=self.__run, name='profiler', daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+    def __run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame, limit=self.depth)
+                self.samples[';'.join(f'{item.name} ({item.filename.rsplit("/", 1)[-1]}:{item.lineno})'
+                                      for item in stack)] += 1
+            time.sleep(self.interval)
+
+    def report(self, top: int = 50):
+        total = sum(self.samples.values()) or 1
+        return '\n'.join(f'{count / total:6.1%} {count:6d} {stack}' for stack, count in self.samples.most_common(top)) + '\n'
+
+
+class MetricsServer:
+    def __init__(self, profiler: SamplingProfiler = None):
+        self.profiler = profiler
+        self.runner = None
+
+    async def metrics(self, request: web.Request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def profile(self, request: web.Request):
+        if not self.profiler:
+            return web.Response(status=404, text='profiler is disabled\n')
+        return web.Response(text=self.profiler.report(), content_type='text/plain', charset='utf-8')
+
+    async def start(self, host: str = config.metrics_host, port: int = config.metrics_port):
+        app = web.Application()
+        app.router.add_get('/metrics', self.metrics)
+        app.router.add_get('/profile', self.profile)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, host, port).start()
+        except OSError as e:
+            # Порт занят (например, второй экземпляр бота) - бот работает дальше без метрик
+            print('[!] METRICS ERROR:', str(e))
+            await self.runner.cleanup()
+            self.runner = None
+            return
+        if self.profiler:
+            self.profiler.start()
+
+    async def stop(self):
+        if self.profiler:
+            self.profiler.stop()
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
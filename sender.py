@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, NetworkError, RestartingTelegram
+
+import config
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def full_for(self, now: float):
+        # Сколько секунд ведро уже полное (отрицательно, если еще наполняется)
+        return now - self.updated - (self.capacity - self.tokens) / self.rate
+
+
+class Sender:
+    # Очередь исходящих сообщений с ограничением скорости по лимитам Telegram
+    def __init__(self, app: Bot, workers: int = config.sender_workers):
+        self.app = app
+        self.workers_count = workers
+        self.queue = asyncio.Queue()
+        self.global_bucket = TokenBucket(config.sender_global_rate, config.sender_global_rate)
+        self.chat_buckets = {}
+        self.swept = time.monotonic()
+        self.__workers = []
+
+    def __sweep(self):
+        # Полное ведро ничем не отличается от нового, поэтому ведра давно молчащих чатов выбрасываем
+        now = time.monotonic()
+        if now - self.swept < config.sender_sweep_interval:
+            return
+        self.swept = now
+        self.chat_buckets = {chat_id: bucket for chat_id, bucket in self.chat_buckets.items()
+                             if bucket.full_for(now) <= 1 / bucket.rate}
+
+    def __chat_bucket(self, chat_id: int):
+        bucket = self.chat_buckets.get(chat_id)
+        if not bucket:
+            self.__sweep()
+            # В группы - не больше 20 сообщений в минуту, в личные чаты - одно в секунду
+            rate = config.sender_group_rate if chat_id < 0 else config.sender_private_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate)
+        return bucket
+
+    def start(self):
+        if not self.__workers:
+            self.__workers = [asyncio.create_task(self.__worker()) for _ in range(self.workers_count)]
+
+    def submit(self, method: str, chat_id: int, *args, **kwargs):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((method, chat_id, args, kwargs, future))
+        return future
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        return self.submit('send_message', chat_id, text, **kwargs)
+
+    async def broadcast(self, messages: list):
+        futures = [self.send_message(chat_id, text) for chat_id, text in messages]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    async def __call(self, method: str, chat_id: int, args: tuple, kwargs: dict):
+        attempt = 0
+        while True:
+            await self.__chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await getattr(self.app, method)(chat_id, *args, **kwargs)
+            except RetryAfter as e:
+                error, delay = e, e.timeout
+            except (NetworkError, RestartingTelegram, asyncio.TimeoutError) as e:
+                error, delay = e, 2 ** attempt
+            attempt += 1
+            if attempt > config.sender_retries:
+                raise error
+            await asyncio.sleep(delay)
+
+    async def __worker(self):
+        while True:
+            method, chat_id, args, kwargs, future = await self.queue.get()
+            try:
+                result = await self.__call(method, chat_id, args, kwargs)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                print('[!] SENDER ERROR:', chat_id, str(e))
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def close(self):
+        await self.queue.join()
+        for worker in self.__workers:
+            worker.cancel()
+        self.__workers = []
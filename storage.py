@@ -0,0 +1,166 @@
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.dispatcher.storage import BaseStorage
+
+import config
+
+
+class SQLiteStorage(BaseStorage):
+    # Хранилище состояний FSM в SQLite (WAL) с отложенной записью:
+    # состояния читаются и меняются в памяти, а на диск сбрасываются пачкой раз в flush_interval секунд
+    def __init__(self, path: typing.Union[os.PathLike, str] = config.db_path, flush_interval: float = config.fsm_flush_interval):
+        self.path = os.path.join(config.project_root, path)
+        self.flush_interval = flush_interval
+        self.data = {}
+        self.dirty = set()
+        self.__db = None
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm')
+        self.__flusher = None
+
+    def __connect(self):
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.path, check_same_thread=False)
+            self.__db.execute('PRAGMA journal_mode = WAL')
+            self.__db.execute('PRAGMA synchronous = NORMAL')
+            self.__db.execute('CREATE TABLE IF NOT EXISTS fsm_states ('
+                              'chat TEXT, user TEXT, state TEXT, data TEXT, bucket TEXT, '
+                              'PRIMARY KEY (chat, user))')
+            self.__db.commit()
+        return self.__db
+
+    async def __run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, func, *args)
+
+    def __load(self, chat: str, user: str):
+        row = self.__connect().execute('SELECT state, data, bucket FROM fsm_states WHERE chat = ? AND user = ?',
+                                       (chat, user)).fetchone()
+        if not row:
+            return {'state': None, 'data': {}, 'bucket': {}}
+        return {'state': row[0], 'data': json.loads(row[1]), 'bucket': json.loads(row[2])}
+
+    def __save(self, records: dict):
+        db = self.__connect()
+        with db:
+            for (chat, user), record in records.items():
+                if record == {'state': None, 'data': {}, 'bucket': {}}:
+                    db.execute('DELETE FROM fsm_states WHERE chat = ? AND user = ?', (chat, user))
+                else:
+                    db.execute('INSERT OR REPLACE INTO fsm_states (chat, user, state, data, bucket) VALUES (?, ?, ?, ?, ?)',
+                               (chat, user, record['state'], json.dumps(record['data']), json.dumps(record['bucket'])))
+
+    async def __record(self, chat, user, write: bool = False):
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        if key not in self.data:
+            record = await self.__run(self.__load, *key)
+            self.data.setdefault(key, record)
+            self.__evict(key)
+        if write:
+            self.dirty.add(key)
+            self.__schedule_flush()
+        return self.data[key]
+
+    def __schedule_flush(self):
+        if self.__flusher is None or self.__flusher.done():
+            self.__flusher = asyncio.create_task(self.__delayed_flush())
+
+    def __evict(self, loaded: tuple):
+        # Вытесняем самые старые записи, которые уже лежат на диске, кроме только что загруженной
+        overflow = len(self.data) - config.fsm_cache_size
+        if overflow <= 0:
+            return
+        for key in [key for key in self.data if key not in self.dirty and key != loaded][:overflow]:
+            del self.data[key]
+
+    async def __delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            # Ошибка уже записана в лог, состояния остались в dirty до следующего сброса
+            pass
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        records = {key: copy.deepcopy(self.data[key]) for key in self.dirty}
+        self.dirty = set()
+        try:
+            await self.__run(self.__save, records)
+        except Exception as e:
+            print('[!] FSM STORAGE ERROR:', str(e))
+            self.dirty |= set(records)
+            self.__flusher = asyncio.create_task(self.__delayed_flush())
+            raise
+        # Пустые записи больше не нужны в памяти
+        for key, record in records.items():
+            if key not in self.dirty and record == {'state': None, 'data': {}, 'bucket': {}}:
+                self.data.pop(key, None)
+        # Записи, сделанные во время сохранения, не запланировали свой сброс: текущий еще не завершился
+        if self.dirty:
+            self.__flusher = asyncio.create_task(self.__delayed_flush())
+
+    async def close(self):
+        if self.__flusher is not None and not self.__flusher.done():
+            self.__flusher.cancel()
+        try:
+            while self.dirty:
+                await self.flush()
+        finally:
+            if self.__flusher is not None and not self.__flusher.done():
+                self.__flusher.cancel()
+        self.data.clear()
+
+    async def wait_closed(self):
+        if self.__db is not None:
+            await self.__run(self.__db.close)
+            self.__db = None
+
+    async def get_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self.__record(chat, user)
+        return record['state'] or self.resolve_state(default)
+
+    async def get_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self.__record(chat, user)
+        return copy.deepcopy(record['data'])
+
+    async def set_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        record = await self.__record(chat, user, write=True)
+        record['state'] = self.resolve_state(state)
+
+    async def set_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        record = await self.__record(chat, user, write=True)
+        record['data'] = copy.deepcopy(data or {})
+
+    async def update_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        record = await self.__record(chat, user, write=True)
+        record['data'].update(data or {}, **kwargs)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self.__record(chat, user)
+        return copy.deepcopy(record['bucket'])
+
+    async def set_bucket(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        record = await self.__record(chat, user, write=True)
+        record['bucket'] = copy.deepcopy(bucket or {})
+
+    async def update_bucket(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        record = await self.__record(chat, user, write=True)
+        record['bucket'].update(bucket or {}, **kwargs)
@@ -1,6 +1,8 @@
 import time
 from datetime import datetime, timedelta, timezone
 import calendar
+import bisect
+import functools
 from typing import Union
 
 
@@ -13,6 +15,8 @@ class TimeManager:
         self.__semesters = [17*7, 24*7]
         self.__holidays = [2*7, 0]
         self.date_pattern = '%d/%m/%Y %H:%M'
+        self.__years = {}
+        self.__resolve_position = functools.lru_cache(maxsize=366)(self.__resolve_day)
 
     @property
     def now(self):
@@ -100,57 +104,78 @@ class TimeManager:
             return (start.timestamp(), end.timestamp())
         return (start, end)
 
-    def graduate_range(self, date: Union[datetime] = None, timestamp: bool = False):
+    def academic_year_start(self, date: Union[datetime] = None):
         if not date:
             date = self.now
-        date_string = '01/09/{year} 00:00:00'.format(year=date.year)
-        start = datetime.strptime(date_string, "%d/%m/%Y %H:%M:%S")
-        end = start
-        for index, semester in enumerate(self.__semesters):
-            end += timedelta(days=semester)
-            end += timedelta(days=self.__holidays[index])
+        year = date.year if date.month >= 9 else date.year - 1
+        return year
+
+    def __academic_year(self, year: int):
+        # Границы семестров учебного года считаются один раз
+        if year not in self.__years:
+            start = datetime(year, 9, 1, tzinfo=self.timezone)
+            slices = []
+            end = start
+            for index, semester in enumerate(self.__semesters):
+                slices.append((end, end + timedelta(days=semester)))
+                end += timedelta(days=semester + self.__holidays[index])
+            self.__years[year] = {
+                'range': (start, end),
+                'slices': slices,
+                'starts': [int(slice_item[0].timestamp()) for slice_item in slices],
+                'ends': [int(slice_item[1].timestamp()) for slice_item in slices],
+            }
+        return self.__years[year]
+
+    def __localize(self, date: Union[datetime] = None):
+        if not date:
+            return self.now
+        if date.tzinfo is None:
+            return date.replace(tzinfo=self.timezone)
+        return date.astimezone(self.timezone)
 
+    def graduate_range(self, date: Union[datetime] = None, timestamp: bool = False):
+        date = self.__localize(date)
+        start, end = self.__academic_year(self.academic_year_start(date))['range']
         if timestamp:
             return (start.timestamp(), end.timestamp())
         return (start, end)
 
     def semesters_time_slices(self, date: Union[datetime] = None, timestamp: bool = False):
-        start_pos = self.graduate_range(date)[0]
-        slices = []
-        days = 0
-        for index, semester in enumerate(self.__semesters):
-            if not index:
-                start = start_pos
-            else:
-                start = start_pos + timedelta(days=days)
-            end = start + timedelta(days=semester)
-            slices.append((start, end))
-            days += self.__holidays[index] + semester
+        date = self.__localize(date)
+        academic_year = self.__academic_year(self.academic_year_start(date))
         if timestamp:
-            slices = [(int(slice_item[0].timestamp()), int(slice_item[1].timestamp())) for slice_item in slices]
-        return slices
-
-    def get_grade(self, date: Union[datetime] = None):
-        if not date:
-            date = self.now
-        current_grade_start = self.graduate_range(date, timestamp=True)[0]
-        grade_diff = current_grade_start - self.__graduate_start_time
-        grade = (grade_diff / 60 / 60 / 24 // 365) + 1
-        return int(round(grade, 0))
+            return list(zip(academic_year['starts'], academic_year['ends']))
+        return list(academic_year['slices'])
+
+    # (курс, семестр) для дня; внутри дня границы не меняются, поэтому результат кэшируется по дате
+    def __resolve_day(self, day):
+        date = datetime(day.year, day.month, day.day, tzinfo=self.timezone)
+        year = self.academic_year_start(date)
+        academic_year = self.__academic_year(year)
+        grade_start = datetime.fromtimestamp(self.__graduate_start_time, tz=self.timezone).year
+        grade = year - grade_start + 1
+
+        timestamp = int(date.timestamp())
+        index = bisect.bisect_right(academic_year['starts'], timestamp) - 1
+        semester = None
+        if index >= 0 and timestamp < academic_year['ends'][index]:
+            semester = index
+        return grade, semester
+
+    def academic_position(self, date: Union[datetime] = None):
+        return self.__resolve_position(self.__localize(date).date())
+
+    # start_year - год поступления группы, если он отличается от группы по умолчанию
+    def get_grade(self, date: Union[datetime] = None, start_year: int = None):
+        grade = self.academic_position(date)[0]
+        if start_year is not None:
+            grade += datetime.fromtimestamp(self.__graduate_start_time, tz=self.timezone).year - start_year
+        return grade
 
     def get_semester(self, date: Union[datetime] = None):
-        if not date:
-            date = self.now
-        slices = self.semesters_time_slices(date, timestamp=True)
-        for index, semester in enumerate(slices):
-            if int(date.timestamp()) in iter(range(*semester)):
-                return index
-        return None
+        return self.academic_position(date)[1]
 
     @property
     def current_semester(self):
         return self.get_semester()
-
-print(TimeManager().current_semester)
-
-
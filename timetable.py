@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import config
+
+from database import AsyncDatabase
+from time_manager import TimeManager
+
+
+class Timetable:
+    # Расписание в памяти: (курс, семестр, группа, день недели) -> список пар
+    def __init__(self, db: AsyncDatabase, tm: TimeManager):
+        self.db = db
+        self.tm = tm
+        self.__index = None
+        self.__texts = {}
+        self.__version = 0
+        # Версия lessons в базе: меняется, когда расписание загружают из другого процесса
+        self.__db_version = None
+        self.__checked = 0
+        self.hits = 0
+        self.misses = 0
+        self.__lock = asyncio.Lock()
+        db.sync.subscribe('lessons', self.invalidate)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / total if total else 0.0}
+
+    def invalidate(self, *args):
+        self.__version += 1
+        self.__index = None
+        self.__texts = {}
+
+    async def load(self):
+        async with self.__lock:
+            if self.__index is not None:
+                return self.__index
+            version = self.__version
+            db_version = await self.db.get_version('lessons')
+            lessons = await self.db.select_all('lessons')
+            index = {}
+            for lesson in sorted(lessons, key=lambda lesson: lesson.id):
+                key = (lesson.grade, lesson.semester, lesson.group_num, lesson.weekday)
+                index.setdefault(key, []).append(lesson)
+            # Пока шла загрузка, расписание могли изменить
+            if version == self.__version:
+                self.__index = index
+                self.__db_version = db_version
+                self.__checked = time.monotonic()
+            return index
+
+    async def __check_version(self):
+        if time.monotonic() - self.__checked < config.timetable_check_interval:
+            return
+        self.__checked = time.monotonic()
+        if await self.db.get_version('lessons') != self.__db_version:
+            self.invalidate()
+
+    def __current(self, start_year: int = None):
+        return self.tm.get_grade(start_year=start_year), self.tm.current_semester
+
+    async def get_lessons(self, group: int, weekday: int, grade: int = None, semester: int = None):
+        if grade is None or semester is None:
+            grade, semester = self.__current()
+        await self.__check_version()
+        index = self.__index
+        if index is None:
+            index = await self.load()
+        common = index.get((grade, semester, 0, weekday), [])
+        if not group:
+            return list(common)
+        own = index.get((grade, semester, group, weekday), [])
+        return sorted(common + own, key=lambda lesson: lesson.id)
+
+    async def get_lessons_today(self, group: int, start_year: int = None):
+        grade, semester = self.__current(start_year)
+        return await self.get_lessons(group, self.tm.now.isoweekday(), grade, semester)
+
+    def __cache(self, key: tuple, text: str, version: int):
+        if version == self.__version:
+            self.__texts[key] = text
+
+    def __lessons_text(self, lessons: list):
+        return '\n'.join(
+            f'{index + 1}. {lesson.name} - <code>{lesson.room_number} каб.</code> ({lesson.time})'
+            for index, lesson in enumerate(lessons)
+        )
+
+    async def week_text(self, group: int, start_year: int = None):
+        grade, semester = self.__current(start_year)
+        key = ('week', grade, semester, group)
+        await self.__check_version()
+        if key in self.__texts:
+            self.hits += 1
+            return self.__texts[key]
+        self.misses += 1
+        version = self.__version
+
+        week = [await self.get_lessons(group, weekday, grade, semester) for weekday in range(1, 8)]
+        weekdays = [index + 1 for index, lessons in enumerate(week) if lessons]
+        if not weekdays:
+            text = '💤 <b>На этой неделе пар нет...</b>'
+        else:
+            text = f'♿️ <b>Все пары на этой неделе</b>:\n\n'
+            for weekday in range(weekdays[0], weekdays[-1] + 1):
+                text += f'🔎 <b>{self.tm.get_weekday_string(weekday)}</b>:\n'
+                if not week[weekday - 1]:
+                    text += '💤 <i>Пар нет...</i>'
+                else:
+                    text += self.__lessons_text(week[weekday - 1])
+                text += '\n\n'
+        self.__cache(key, text, version)
+        return text
+
+    async def daily_text(self, group: int, weekday: int = None, start_year: int = None):
+        grade, semester = self.__current(start_year)
+        if weekday is None:
+            weekday = self.tm.now.isoweekday()
+        key = ('daily', grade, semester, group, weekday)
+        await self.__check_version()
+        if key in self.__texts:
+            self.hits += 1
+            return self.__texts[key]
+        self.misses += 1
+        version = self.__version
+
+        lessons = await self.get_lessons(group, weekday, grade, semester)
+        text = None
+        if lessons:
+            text = f'♿️ <b>Пары в {self.tm.get_weekday_string(weekday)}</b>:\n\n{self.__lessons_text(lessons)}'
+        self.__cache(key, text, version)
+        return text
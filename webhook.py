@@ -0,0 +1,83 @@
+import asyncio
+from collections import deque
+
+from aiohttp import web
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.webhook import configure_app
+
+import config
+
+
+class UpdateGate(BaseMiddleware):
+    # Отбрасывает повторно присланные обновления и ограничивает число одновременно обрабатываемых
+    def __init__(self, concurrency: int = config.webhook_concurrency, dedup_size: int = config.webhook_dedup_size):
+        super().__init__()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.dedup_size = dedup_size
+        self.seen = set()
+        self.order = deque()
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def __remember(self, update_id: int):
+        self.seen.add(update_id)
+        self.order.append(update_id)
+        if len(self.order) > self.dedup_size:
+            self.seen.discard(self.order.popleft())
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if update.update_id in self.seen:
+            raise CancelHandler()
+        self.__remember(update.update_id)
+        await self.semaphore.acquire()
+        self.in_flight += 1
+        self.idle.clear()
+        data['gate_acquired'] = True
+
+    async def on_post_process_update(self, update: types.Update, results: list, data: dict):
+        if not data.pop('gate_acquired', False):
+            return
+        self.semaphore.release()
+        self.in_flight -= 1
+        if not self.in_flight:
+            self.idle.set()
+
+    # Дожидаемся обновлений, которые уже обрабатываются
+    async def drain(self, timeout: float = config.webhook_drain_timeout):
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f'[!] WEBHOOK: {self.in_flight} updates still in progress after {timeout} s')
+
+
+def make_app(dp: Dispatcher, on_startup=None, on_shutdown=None):
+    gate = UpdateGate()
+    dp.middleware.setup(gate)
+    app = web.Application()
+    configure_app(dp, app, config.webhook_path)
+
+    async def startup(app: web.Application):
+        if on_startup:
+            await on_startup(dp)
+        if config.webhook_url:
+            await dp.bot.set_webhook(config.webhook_url + config.webhook_path)
+
+    async def shutdown(app: web.Application):
+        await gate.drain()
+        if on_shutdown:
+            await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def start_webhook(dp: Dispatcher, on_startup=None, on_shutdown=None):
+    web.run_app(make_app(dp, on_startup, on_shutdown), host=config.webapp_host, port=config.webapp_port)
@@ -0,0 +1,148 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+
+from aiogram import Bot, Dispatcher, types
+
+import config
+
+
+def update_chat_id(update: types.Update):
+    # Обновления одного чата всегда попадают в один процесс, чтобы состояние FSM не расходилось
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message:
+            return message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    if update.my_chat_member:
+        return update.my_chat_member.chat.id
+    if update.poll_answer:
+        return update.poll_answer.user.id
+    return 0
+
+
+class LeaderLock:
+    # Только процесс, держащий блокировку, рассылает напоминания
+    def __init__(self, db, name: str = 'reminders', ttl: float = config.leader_lock_ttl):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.leader = False
+
+    async def run(self, on_acquired, on_lost):
+        while True:
+            try:
+                held = await self.db.acquire_lock(self.name, self.owner, self.ttl)
+            except Exception as e:
+                print('[!] LEADER LOCK ERROR:', str(e))
+                held = False
+            if held and not self.leader:
+                self.leader = True
+                await on_acquired()
+            elif not held and self.leader:
+                self.leader = False
+                await on_lost()
+            await asyncio.sleep(self.ttl / 3)
+
+    async def release(self):
+        if self.leader:
+            await self.db.release_lock(self.name, self.owner)
+            self.leader = False
+
+
+async def worker_loop(index: int, queue: multiprocessing.Queue):
+    import main
+
+    Bot.set_current(main.app)
+    # Состояния FSM (State.set, StatesGroup.next) берут диспетчер из контекста
+    Dispatcher.set_current(main.dp)
+    await main.start_subsystems(reminders=False, metrics_port=config.metrics_port + index + 1)
+    lock = LeaderLock(main.db)
+
+    async def lead():
+        await main.ck.start(config.leader_watch_interval)
+        await main.maintenance.start()
+        await main.digest.start()
+
+    async def step_down():
+        await main.ck.stop()
+        await main.maintenance.stop()
+        await main.digest.stop()
+
+    lock_task = asyncio.create_task(lock.run(lead, step_down))
+    print(f'[*] Worker {index} started, pid {os.getpid()}')
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    while True:
+        raw = await loop.run_in_executor(None, queue.get)
+        if raw is None:
+            break
+        task = asyncio.create_task(main.dp.process_update(types.Update(**raw)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+    lock_task.cancel()
+    await step_down()
+    await lock.release()
+    await main.on_shutdown(main.dp)
+    await main.dp.storage.close()
+    await main.dp.storage.wait_closed()
+    session = await main.app.get_session()
+    await session.close()
+
+
+def worker_main(index: int, queue: multiprocessing.Queue):
+    # Ctrl+C обрабатывает главный процесс и присылает None, чтобы обработчики доделали начатое
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(worker_loop(index, queue))
+
+
+async def poll_updates(queues: list):
+    # Один процесс забирает обновления из Telegram и раскладывает их по обработчикам по chat_id
+    bot = Bot(token=config.botToken)
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=20)
+            except Exception as e:
+                print('[!] POLLING ERROR:', str(e))
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                queues[update_chat_id(update) % len(queues)].put(update.to_python())
+    finally:
+        session = await bot.get_session()
+        await session.close()
+
+
+def run(workers: int = config.workers):
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [context.Process(target=worker_main, args=(index, queue), daemon=True)
+                 for index, queue in enumerate(queues)]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(poll_updates(queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=config.webhook_drain_timeout)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else config.workers)